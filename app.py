@@ -1,16 +1,74 @@
 import asyncio
+import contextvars
+import functools
+import hashlib
+import importlib
+import importlib.util
 import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import random
 import re
-import aiohttp
-import httpx
-import openai
-import fitz
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
-from io import BytesIO
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Time the app started loading, for the startup report
+STARTUP_STARTED = time.perf_counter()
+startup_seconds = None  # seconds startup took, None in a process that skipped it
+
 from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
-from lxml import html
-from youtube_transcript_api import YouTubeTranscriptApi
+
+from extraction import TextExtractor, extract_document_text, extract_pdf_pages
+
+# Heavy modules are imported when a handler first uses them, set CHAT_WEBUI_EAGER_IMPORTS=1 to import them at startup
+LAZY_IMPORTS = os.environ.get('CHAT_WEBUI_EAGER_IMPORTS') != '1'
+module_import_seconds = {}  # module name -> seconds its import took
+
+# Stand-in for a module that imports it on first attribute access
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def _load(self):
+        if self._module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            module_import_seconds.setdefault(self._name, time.perf_counter() - start)
+            self._module = module
+        return self._module
+
+# Function to declare a heavy module, imported at once unless lazy imports are on
+def lazy_import(name):
+    module = LazyModule(name)
+    if not LAZY_IMPORTS:
+        module._load()
+    return module
+
+aiohttp = lazy_import('aiohttp')
+httpx = lazy_import('httpx')
+openai = lazy_import('openai')
+fitz = lazy_import('fitz')
+docx = lazy_import('docx')
+etree = lazy_import('lxml.etree')
+html = lazy_import('lxml.html')
+youtube_transcript_api = lazy_import('youtube_transcript_api')
+requests = lazy_import('requests')
 
 
 # Initialize Flask app
@@ -24,58 +82,1045 @@ SYSTEM_CONTENT = "Be a helpful assistant"
 # Constants for web search
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
 DEFAULT_RESULTS = 3
+MAX_RESULTS = 10  # results fetched per query at most
+BATCH_MAX_QUERIES = 10  # queries in one batch search request at most
 TIMEOUT = 10  # seconds
 RETRY_LIMIT = 3
-RATE_LIMIT = 0.5  # seconds
+RATE_LIMIT = 0.5  # seconds, base delay of the exponential retry backoff
+BACKOFF_MAX = 8  # seconds
+SEARCH_URL = 'https://lite.duckduckgo.com/lite/'
+SEARCH_CONCURRENCY = 8  # search and page requests running at once across all searches
+HOST_MIN_INTERVAL = 0.2  # seconds between two requests to the same host
+HOST_SCHEDULE_MAX_ENTRIES = 1024  # hosts remembered for spacing before past entries are dropped
+SEARCH_SOFT_DEADLINE = 3  # seconds to wait for slower sources once the first one is ready
+RETRIEVAL_WORKERS = 16
+
+# Constants for the shared outbound connection pools
+POOL_MAX_CONNECTIONS = 100
+POOL_MAX_KEEPALIVE_CONNECTIONS = 100  # idle connections kept across all hosts, httpx has no per-host cap
+POOL_MAX_CONNECTIONS_PER_HOST = 10  # only enforced by the aiohttp connector
+POOL_KEEPALIVE_EXPIRY = 30  # seconds
+CONNECT_TIMEOUT = 5  # seconds
+DNS_CACHE_TTL = 300  # seconds
+HTTP2_ENABLED = importlib.util.find_spec('h2') is not None  # httpx needs the optional h2 package
+
+# Constants for the fetched content cache
+CACHE_TTL = 3600  # seconds
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # approximate size of all cached values kept in memory
+CACHE_DB_FILE = None  # Set to a path such as 'cache.db' to keep cached content across restarts
+CACHE_DB_MAX_ENTRIES = 5000
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+# Constants for webpage text extraction
+MAX_PAGE_BYTES = 5 * 1024 * 1024  # stop downloading a page after this many bytes
+MAX_PAGE_CHARS = 200000  # stop parsing a page once this much text has been extracted
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Constants for PDF text extraction
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+PDF_PAGES_PER_TASK = 8
+PDF_PARALLEL_MIN_PAGES = 16  # smaller documents are extracted in the request thread
+PDF_MAX_PAGES = None  # stop extracting after this many pages, None reads the whole document
+MAX_PDF_BYTES = 50 * 1024 * 1024  # linked PDFs larger than this are not downloaded
+
+# Constants for YouTube transcripts
+TRANSCRIPT_WORKERS = 4
+TRANSCRIPT_TIMEOUT = 20  # seconds to wait for a transcript before giving up
+TRANSCRIPT_REQUEST_TIMEOUT = 10  # seconds each request of a download may stall, so an abandoned download frees its worker
+TRANSCRIPT_LANGUAGES = ('en',)  # preferred languages in order, otherwise the first listed transcript is used
+TRANSCRIPT_BUCKET_SECONDS = 0  # group the transcript into [hh:mm:ss] lines of this many seconds, 0 joins it into one text
+TRANSCRIPT_MAX_TOKENS = None  # bucketed transcripts are trimmed to this many tokens, None uses CONTEXT_TOKEN_BUDGET
+
+# Constants for packing source text into the prompt
+CONTEXT_TOKEN_BUDGET = 8000  # tokens of source text sent with a message
+MODEL_CONTEXT_BUDGETS = {}  # per-model overrides, e.g. {'gpt-4o': 30000}
+CONTEXT_CHUNK_TOKENS = 256
+CHARS_PER_TOKEN = 4  # estimate used when tiktoken is not installed
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Constants for the server-side conversation store
+CONVERSATIONS_DB_FILE = 'conversations.db'
+CONVERSATION_CACHE_SIZE = 64  # conversations kept in memory
+CONVERSATION_MAX_MESSAGES = 200  # older messages are dropped beyond this
+CONVERSATION_MAX_CHARS = 500000  # older messages are dropped beyond this much content
 
-# Global variables to store API key, base URL, and models
+# Constants for uploaded documents
+DOCUMENTS_DB_FILE = 'documents.db'
+UPLOAD_DIR = 'uploads'
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # 50 MB
+DOCUMENT_MAX_CHARS = 5000000  # text kept from one document
+DOCUMENT_EXTENSIONS = {'pdf': '.pdf', 'docx': '.docx', 'html': '.html', 'text': '.txt'}
+
+# Constants for the retrieval index over fetched sources
+RETRIEVAL_DB_FILE = 'retrieval.db'
+RETRIEVAL_TOP_K = 6  # chunks added to a follow-up question
+RETRIEVAL_MAX_SOURCES = 50  # sources kept per scope, the oldest are dropped first
+
+# Constants for the cache of deterministic completions such as titles
+COMPLETION_CACHE_MAX_ENTRIES = 1024
+COMPLETION_CACHE_MAX_BYTES = 8 * 1024 * 1024
+COMPLETION_CACHE_TTL = 7 * 24 * 3600  # seconds
+COMPLETION_CACHE_DB_FILE = None  # Set to a path such as 'completions.db' to keep cached completions across restarts
+TITLE_CONCURRENCY = 2  # background title generations running at once
+
+# Constants for streaming responses
+STREAM_FLUSH_INTERVAL = 0.05  # seconds deltas are held back to be sent in one write, 0 sends every delta
+STREAM_FLUSH_BYTES = 1024  # send at once when this many bytes are waiting
+SSE_HEARTBEAT_INTERVAL = 15  # seconds without events before an SSE comment keeps the connection alive
+SSE_STREAM_TTL = 300  # seconds a finished SSE stream can still be resumed
+SSE_MAX_STREAMS = 256  # SSE streams kept for resuming
+SSE_LINE_BREAK_PATTERN = re.compile(r'\r\n|\r|\n')
+ASGI_DISPATCH_WORKERS = 100  # threads running Flask views under asgi_app, a streaming response gives its thread back at once
+ASGI_MAX_BODY_BYTES = MAX_UPLOAD_BYTES + 1024 * 1024  # largest request body asgi_app accepts, an upload plus its form encoding
+ASGI_BODY_SPOOL_BYTES = 1024 * 1024  # request bodies larger than this are spooled to a temporary file
+
+# Constants for admission control
+MAX_CONCURRENT_STREAMS = 32  # chat streams running at once across all clients
+MAX_STREAMS_PER_CLIENT = 4  # chat streams one client address may run or queue at once
+MAX_CONCURRENT_RETRIEVALS = 8  # @s retrievals and batch searches running at once, at most RETRIEVAL_WORKERS
+MAX_RETRIEVALS_PER_CLIENT = 2
+ADMISSION_QUEUE_SIZE = 64  # requests that may wait for a slot, more are turned away at once
+ADMISSION_TIMEOUT = 10  # seconds a request waits for a slot before it is turned away
+ADMISSION_RETRY_AFTER = 5  # seconds clients that were turned away are asked to wait
+# Behind a reverse proxy every request comes from the proxy's address, so the per-client limits need the real client
+CLIENT_ADDRESS_HEADER = None  # header a trusted proxy sets to the client address, such as 'X-Real-IP'
+TRUSTED_PROXY_COUNT = 0  # proxies in front of the app that append to X-Forwarded-For, 0 uses the peer address
+
+# Constants for request metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # seconds
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)  # tokens per second
+
+# Constants for routing between upstream providers
+PROVIDER_ROUTING = 'least_outstanding'  # 'least_outstanding' or 'latency'
+PROVIDER_LATENCY_ALPHA = 0.3  # weight of the newest time to first token in a provider's moving average
+PROVIDER_COOLDOWN = 5  # seconds a failing provider is skipped, doubled for each failure in a row
+PROVIDER_COOLDOWN_MAX = 120  # seconds
+
+# Global variables to store API key, base URL, and the upstream providers
 api_key = None
 base_url = None
-openai_client = None
-preloaded_models = []
+provider_pool = None
 
 # File to store settings
 SETTINGS_FILE = 'settings.json'
 
+# Constants for the model list cache
+MODELS_CACHE_FILE = 'models_cache.json'
+MODEL_CACHE_TTL = 600  # seconds before a model list is refreshed in the background
+MODEL_FETCH_WAIT = 10  # seconds a request waits when an endpoint has no cached model list yet
+
+# Background event loop shared by every upstream stream
+event_loop = None
+event_loop_lock = threading.Lock()
+
+# Function to get the background event loop, starting it on first use
+def get_event_loop():
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(target=event_loop.run_forever, name='event-loop', daemon=True).start()
+    return event_loop
+
+# Function to make the running loop of an ASGI server the app's event loop
+def adopt_event_loop():
+    """Return True when the app's event loop is the running loop.
+
+    Upstream clients are bound to the loop they were first used on, so under
+    asgi_app the server's loop takes the place of the background loop. This
+    only works when nothing has started the background loop yet.
+    """
+    global event_loop
+    loop = asyncio.get_running_loop()
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = loop
+    return event_loop is loop
+
+# Function to run a coroutine on the background event loop and wait for its result
+def run_async(coro, timeout=None):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+# Function to iterate an async generator running on the background event loop
+def iterate_async(async_gen):
+    """Bridge an async generator to a regular generator for Flask responses.
+
+    The async generator is driven by the event loop and its items are handed
+    over through a queue, so the upstream socket is never touched by the
+    request thread. Closing the returned generator cancels the async side.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in async_gen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+# Logger for one structured JSON line per request
+logger = logging.getLogger('chat_webui')
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(log_handler)
+    logger.setLevel(logging.INFO)
+
+# In-process counters, gauges and histograms rendered in the Prometheus text format
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = {}
+        self.help = {}
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> (buckets, bucket counts, sum, count)
+
+    def describe(self, name, metric_type, help_text):
+        self.types[name] = metric_type
+        self.help[name] = help_text
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            bucket_list, counts, total, count = self.histograms.get(key, (buckets, [0] * len(buckets), 0.0, 0))
+            for index, bound in enumerate(bucket_list):
+                if value <= bound:
+                    counts[index] += 1
+            self.histograms[key] = (bucket_list, counts, total + value, count + 1)
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (buckets, list(counts), total, count) for key, (buckets, counts, total, count) in self.histograms.items()}
+
+        lines = []
+        described = set()
+
+        def header(name, default_type):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types.get(name, default_type)}")
+
+        def format_labels(labels):
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            header(name, 'histogram')
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {bucket_count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('chat_webui_requests_total', 'counter', 'Requests handled, by route and command.')
+metrics.describe('chat_webui_phase_seconds', 'histogram', 'Time spent in each request phase.')
+metrics.describe('chat_webui_upstream_ttft_seconds', 'histogram', 'Time from the upstream request to its first token.')
+metrics.describe('chat_webui_stream_duration_seconds', 'histogram', 'Total duration of streamed completions.')
+metrics.describe('chat_webui_stream_tokens_per_second', 'histogram', 'Generation speed of streamed completions after the first token.')
+metrics.describe('chat_webui_stream_errors_total', 'counter', 'Streamed completions that ended with an error.')
+metrics.describe('chat_webui_provider_failures_total', 'counter', 'Upstream calls that failed with a rate limit, server error or connection error, by provider.')
+metrics.describe('chat_webui_admission_wait_seconds', 'histogram', 'Time requests waited for a stream or retrieval slot.')
+metrics.describe('chat_webui_admission_rejected_total', 'counter', 'Requests turned away with a 429, by gate and reason.')
+metrics.describe('chat_webui_documents_total', 'counter', 'Uploaded documents, by kind and whether they were new or a duplicate.')
+metrics.describe('chat_webui_coalesced_requests_total', 'counter', 'Fetches that started a download (leader) or joined one in flight (follower).')
+
+# Phase timings of the request being handled, copied into tasks on the event loop
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+# Function to record the time spent in a phase, globally and for the current request
+def record_phase(phase, seconds):
+    metrics.observe('chat_webui_phase_seconds', seconds, {'phase': phase})
+    timings = request_timings.get()
+    if timings is not None:
+        timings[phase] = round(timings.get(phase, 0) + seconds, 6)
+
+# Context manager to time a phase of the current request
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+# Progress callback of the request being handled, set while its retrieval runs
+progress_reporter = contextvars.ContextVar('progress_reporter', default=None)
+
+# Retrieval index scope of the request being handled, fetched sources are indexed under it
+retrieval_scope = contextvars.ContextVar('retrieval_scope', default=None)
+
+# Function to report retrieval progress to the client of the current request
+def report_progress(stage, message, **details):
+    reporter = progress_reporter.get()
+    if reporter is not None:
+        reporter(dict(details, stage=stage, message=message))
+
+# Thread pool that runs the retrieval of @s commands
+retrieval_executor = None
+retrieval_executor_lock = threading.Lock()
+
+# Function to get the retrieval thread pool, starting it on first use
+def get_retrieval_executor():
+    global retrieval_executor
+    with retrieval_executor_lock:
+        if retrieval_executor is None:
+            retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix='retrieval')
+    return retrieval_executor
+
+# Raised when a request cannot get a slot, answered with a 429
+class AdmissionRejected(Exception):
+    def __init__(self, gate, reason, retry_after=ADMISSION_RETRY_AFTER):
+        super().__init__(f"Too many {gate} requests ({reason}), please retry later")
+        self.reason = reason
+        self.retry_after = retry_after
+
+# Cap on concurrent work with a per-client cap and a bounded queue of waiting requests
+class AdmissionGate:
+    """Hand out up to limit slots, each client holding at most client_limit.
+
+    A request waits in the queue when every slot is taken and is rejected
+    when the queue is full, when its client is over its own cap, or when no
+    slot frees up within the timeout.
+    """
+
+    def __init__(self, name, limit, client_limit, queue_size=ADMISSION_QUEUE_SIZE, timeout=ADMISSION_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.client_limit = client_limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.clients = {}  # client -> slots held or waited for
+
+    def acquire(self, client):
+        start = time.perf_counter()
+        with self.condition:
+            if self.clients.get(client, 0) >= self.client_limit:
+                self.reject('client_limit')
+            if self.active >= self.limit or self.waiting:
+                if self.waiting >= self.queue_size:
+                    self.reject('queue_full')
+                self.clients[client] = self.clients.get(client, 0) + 1
+                self.waiting += 1
+                try:
+                    is_admitted = self.condition.wait_for(lambda: self.active < self.limit, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not is_admitted:
+                    self.forget(client)
+                    self.reject('timeout')
+            else:
+                self.clients[client] = self.clients.get(client, 0) + 1
+            self.active += 1
+        metrics.observe('chat_webui_admission_wait_seconds', time.perf_counter() - start, {'gate': self.name})
+
+    def release(self, client):
+        with self.condition:
+            self.active -= 1
+            self.forget(client)
+            self.condition.notify_all()
+
+    def forget(self, client):
+        if self.clients[client] > 1:
+            self.clients[client] -= 1
+        else:
+            del self.clients[client]
+
+    def reject(self, reason):
+        metrics.inc('chat_webui_admission_rejected_total', {'gate': self.name, 'reason': reason})
+        raise AdmissionRejected(self.name, reason)
+
+    def get_stats(self):
+        with self.condition:
+            return {'active': self.active, 'queue_depth': self.waiting, 'clients': len(self.clients)}
+
+stream_gate = AdmissionGate('stream', MAX_CONCURRENT_STREAMS, MAX_STREAMS_PER_CLIENT)
+retrieval_gate = AdmissionGate('retrieval', MAX_CONCURRENT_RETRIEVALS, MAX_RETRIEVALS_PER_CLIENT)
+
+# Slots held by one request, released once its work or its response is finished
+class AdmissionTicket:
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.gates = []
+
+    def acquire(self, gate):
+        gate.acquire(self.client)
+        with self.lock:
+            self.gates.append(gate)
+
+    def release(self, gate=None):
+        """Release the slot of gate, or every slot, safe to call more than once."""
+        with self.lock:
+            released = [held for held in self.gates if gate is None or held is gate]
+            self.gates = [held for held in self.gates if held not in released]
+        for held in released:
+            held.release(self.client)
+
+# Function to get the client address that per-client admission limits are counted by
+def get_client_address():
+    """Only headers set by trusted proxies are used, since clients can send any
+    X-Forwarded-For. With TRUSTED_PROXY_COUNT proxies, the client is the entry
+    that many places from the right, as with werkzeug's ProxyFix."""
+    if CLIENT_ADDRESS_HEADER:
+        address = request.headers.get(CLIENT_ADDRESS_HEADER, '').strip()
+        if address:
+            return address
+    if TRUSTED_PROXY_COUNT:
+        forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',') if address.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_COUNT:
+            return forwarded[-TRUSTED_PROXY_COUNT]
+    return request.remote_addr
+
+# Function to admit a request through the given gates, releasing what it got if one rejects it
+def admit_request(*gates):
+    ticket = AdmissionTicket(get_client_address())
+    try:
+        for gate in gates:
+            ticket.acquire(gate)
+    except AdmissionRejected:
+        ticket.release()
+        raise
+    return ticket
+
+# Function to build the 429 response for a rejected request
+def admission_rejected_response(error):
+    return jsonify({"error": str(error)}), 429, {'Retry-After': str(error.retry_after)}
+
+# Shared outbound HTTP clients and their connection statistics
+http_client = None
+aiohttp_session = None
+http_client_lock = threading.Lock()
+pool_stats = {
+    'httpx': {'requests': 0, 'new_connections': 0},
+    'aiohttp': {'requests': 0, 'new_connections': 0, 'reused_connections': 0, 'dns_cache_hits': 0, 'dns_cache_misses': 0},
+}
+pool_stats_lock = threading.Lock()
+
+# Function to increment a connection pool counter
+def count_pool_event(client_name, counter):
+    with pool_stats_lock:
+        pool_stats[client_name][counter] += 1
+
+# Functions to count new connections made by the httpx clients
+def trace_httpx_connection(event_name, info):
+    if event_name == 'connection.connect_tcp.complete':
+        count_pool_event('httpx', 'new_connections')
+
+async def trace_async_httpx_connection(event_name, info):
+    trace_httpx_connection(event_name, info)
+
+def on_httpx_request(request):
+    count_pool_event('httpx', 'requests')
+    request.extensions['trace'] = trace_httpx_connection
+
+async def on_async_httpx_request(request):
+    count_pool_event('httpx', 'requests')
+    request.extensions['trace'] = trace_async_httpx_connection
+
+# Function to build the keyword arguments shared by both httpx clients
+def httpx_client_options():
+    return {
+        'http2': HTTP2_ENABLED,
+        'limits': httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+        'follow_redirects': True,
+    }
+
+# Function to get the shared synchronous httpx client
+def get_http_client():
+    global http_client
+    with http_client_lock:
+        if http_client is None:
+            http_client = httpx.Client(
+                event_hooks={'request': [on_httpx_request]},
+                **httpx_client_options()
+            )
+    return http_client
+
+# Function to create an asynchronous httpx client, each upstream provider gets its own pool
+def create_async_http_client():
+    return httpx.AsyncClient(
+        event_hooks={'request': [on_async_httpx_request]},
+        **httpx_client_options()
+    )
+
+# Function to get the shared aiohttp session, must be called on the background event loop
+async def get_aiohttp_session():
+    global aiohttp_session
+    if aiohttp_session is None or aiohttp_session.closed:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            count_pool_event('aiohttp', 'requests')
+
+        async def on_connection_create_end(session, context, params):
+            count_pool_event('aiohttp', 'new_connections')
+
+        async def on_connection_reuseconn(session, context, params):
+            count_pool_event('aiohttp', 'reused_connections')
+
+        async def on_dns_cache_hit(session, context, params):
+            count_pool_event('aiohttp', 'dns_cache_hits')
+
+        async def on_dns_cache_miss(session, context, params):
+            count_pool_event('aiohttp', 'dns_cache_misses')
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+
+        connector = aiohttp.TCPConnector(
+            limit=POOL_MAX_CONNECTIONS,
+            limit_per_host=POOL_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=POOL_KEEPALIVE_EXPIRY,
+            ttl_dns_cache=DNS_CACHE_TTL,
+        )
+        aiohttp_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT, sock_connect=CONNECT_TIMEOUT),
+            trace_configs=[trace_config],
+        )
+    return aiohttp_session
+
+# Function to summarize connection pool usage, a reused connection counts as a hit
+def get_pool_stats():
+    with pool_stats_lock:
+        stats = {name: dict(counters) for name, counters in pool_stats.items()}
+    for counters in stats.values():
+        counters['pool_hits'] = max(counters['requests'] - counters['new_connections'], 0)
+        counters['pool_misses'] = counters['new_connections']
+    stats['http2'] = HTTP2_ENABLED
+    return stats
+
+# Size-bounded LRU cache with a TTL and an optional SQLite tier
+class ContentCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, db_file=None, db_max_entries=CACHE_DB_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.db_max_entries = db_max_entries
+        self.entries = OrderedDict()  # key -> (value, expires_at, validators)
+        self.sizes = {}  # key -> approximate size of the value in bytes
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'revalidated': 0, 'evictions': 0}
+        self.db = None
+        if db_file:
+            self.db = sqlite3.connect(db_file, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, validators TEXT, accessed_at REAL)'
+            )
+            self.db.commit()
+
+    def get(self, key, count=True):
+        """Return (value, validators, is_fresh) for a key, or None if it is not cached.
+
+        Expired entries are still returned so their validators can be used for a
+        conditional request; callers must check is_fresh. A repeated lookup for
+        the same request passes count=False to leave the hit rate alone.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            elif self.db is not None:
+                row = self.db.execute(
+                    'SELECT value, expires_at, validators FROM cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1], json.loads(row[2]))
+                    self._store(key, entry)
+                    self.db.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (time.time(), key))
+                    self.db.commit()
+            if entry is None:
+                if count:
+                    self.stats['misses'] += 1
+                return None
+            value, expires_at, validators = entry
+            is_fresh = expires_at > time.time()
+            if count:
+                self.stats['hits' if is_fresh else 'stale_hits'] += 1
+            return value, validators, is_fresh
+
+    def set(self, key, value, validators=None, ttl=None):
+        entry = (value, time.time() + (self.ttl if ttl is None else ttl), validators or {})
+        with self.lock:
+            self._store(key, entry)
+            if self.db is not None:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                    (key, json.dumps(entry[0]), entry[1], json.dumps(entry[2]), time.time())
+                )
+                self.db.execute(
+                    'DELETE FROM cache WHERE key IN '
+                    '(SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                    (self.db_max_entries,)
+                )
+                self.db.commit()
+
+    def refresh(self, key, ttl=None):
+        """Extend the lifetime of an entry after the origin confirmed it is unchanged."""
+        with self.lock:
+            entry = self.entries.get(key)
+            self.stats['revalidated'] += 1
+        if entry is not None:
+            self.set(key, entry[0], entry[2], ttl)
+
+    def _store(self, key, entry):
+        size = cached_value_size(entry[0])
+        self.total_bytes += size - self.sizes.get(key, 0)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.sizes[key] = size
+        # A value larger than the whole budget evicts everything else, then itself
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            evicted_key, _ = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(evicted_key)
+            self.stats['evictions'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, entries=len(self.entries), bytes=self.total_bytes)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+# Function to estimate the memory held by a cached value, cached values are JSON-serializable
+def cached_value_size(value):
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+# Shared cache for fetched pages, search results, transcripts and arXiv papers
+content_cache = ContentCache(db_file=CACHE_DB_FILE)
+
+# Function to normalize a URL so equivalent links share a cache entry
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not (scheme, parts.port) in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    ))
+    return urlunsplit((scheme, host, path, query, ''))
+
+# Function to build the conditional request headers for a cached entry
+def revalidation_headers(validators):
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+# Function to read the cache validators from a response
+def response_validators(response):
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+# Deduplicates concurrent identical fetches so they share one in-flight call
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Future of the in-flight call
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the call already running for the same key.
+
+        Every waiter gets the leader's result or exception. Keys are prefixed
+        with their source, e.g. "page:" or "youtube:", which labels the counters.
+        """
+        source = key.split(':', 1)[0]
+        with self.lock:
+            future = self.calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.calls[key] = Future()
+        metrics.inc('chat_webui_coalesced_requests_total', {'source': source, 'role': 'leader' if is_leader else 'follower'})
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+
+    async def do_async(self, key, fn):
+        """Await fn() for key on the event loop, sharing calls with do().
+
+        A follower waits without blocking the loop, whether the leader runs
+        in a thread or on the loop. A cancelled leader fails its followers
+        instead of cancelling them.
+        """
+        source = key.split(':', 1)[0]
+        with self.lock:
+            future = self.calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.calls[key] = Future()
+        metrics.inc('chat_webui_coalesced_requests_total', {'source': source, 'role': 'leader' if is_leader else 'follower'})
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError(f"The shared call for {key} was cancelled"))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+
+single_flight = SingleFlight()
+
+# Function to fetch a URL through the content cache, revalidating expired entries
+def fetch_cached(cache_key, url, parse, phase='page_fetch'):
+    """Return parse(response) for url, reusing the cached result while it is fresh.
+
+    The response is streamed, so parse() either iterates over it or calls
+    response.read() when it needs the whole body.
+
+    Expired entries that carry an ETag or Last-Modified are revalidated with a
+    conditional request, so an unchanged page is not downloaded or parsed again.
+    Concurrent misses for the same key share one download.
+    """
+    cached = content_cache.get(cache_key)
+    if cached is not None and cached[2]:
+        return cached[0]
+
+    def fetch():
+        # A call for the same key may have filled the cache after the check above
+        cached = content_cache.get(cache_key, count=False)
+        if cached is not None and cached[2]:
+            return cached[0]
+        headers = revalidation_headers(cached[1]) if cached is not None else {}
+        with timed(phase), get_http_client().stream('GET', url, headers=headers) as response:
+            if cached is not None and response.status_code == 304:
+                content_cache.refresh(cache_key)
+                return cached[0]
+            response.raise_for_status()
+
+            value = parse(response)
+        content_cache.set(cache_key, value, response_validators(response))
+        return value
+
+    return single_flight.do(cache_key, fetch)
+
+# Incremental HTML to text pipeline with byte and character budgets
+class HTMLTextStream:
+    """Feed an HTML document chunk by chunk and collect its visible text.
+
+    Script and style contents are dropped as they are parsed, and feed()
+    returns False once either budget is used up so the caller can stop
+    downloading the rest of the page.
+    """
+
+    def __init__(self, max_bytes=MAX_PAGE_BYTES, max_chars=MAX_PAGE_CHARS, encoding=None):
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.parse_seconds = 0.0
+        self.extractor = TextExtractor(max_chars)
+        self.parser = etree.HTMLParser(target=self.extractor, encoding=encoding)
+
+    def feed(self, chunk):
+        start = time.perf_counter()
+        self.parser.feed(chunk)
+        self.parse_seconds += time.perf_counter() - start
+        self.received += len(chunk)
+        return self.received < self.max_bytes and not self.extractor.is_full
+
+    def close(self):
+        start = time.perf_counter()
+        text = self.parser.close()
+        record_phase('parse', self.parse_seconds + time.perf_counter() - start)
+        return text
+
+# Function to extract the visible text from an iterable of HTML chunks
+def extract_text_from_chunks(chunks, encoding=None):
+    text_stream = HTMLTextStream(encoding=encoding)
+    for chunk in chunks:
+        if not text_stream.feed(chunk):
+            break
+    return text_stream.close()
+
+# An OpenAI-compatible endpoint with its own client, connection pool and health
+class Provider:
+    def __init__(self, name, api_key, base_url, models=None, max_retries=None):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.models = set(models or [])  # models routed to this provider, empty to serve any model
+        self.listed_models = set()  # models the endpoint itself reported
+        self.max_retries = max_retries  # None keeps the SDK's default
+        self._client = None
+        self.outstanding = 0
+        self.latency = None  # moving average of the time to first token, in seconds
+        self.failures = 0  # failures in a row
+        self.unavailable_until = 0.0
+        self.last_error = None
+        self.is_retired = False  # replaced by a settings change, closed once idle
+
+    @property
+    def client(self):
+        # Created on first use, so loading the settings does not import the OpenAI SDK
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=create_async_http_client(),
+                max_retries=openai.DEFAULT_MAX_RETRIES if self.max_retries is None else self.max_retries,
+            )
+        return self._client
+
+    def close(self):
+        # The client and its connection pool belong to the event loop, so they are closed there
+        client, self._client = self._client, None
+        if client is not None:
+            asyncio.run_coroutine_threadsafe(client.close(), get_event_loop())
+
+    def serves(self, model):
+        if self.models:
+            return model in self.models
+        return not self.listed_models or model in self.listed_models
+
+    def is_healthy(self, now):
+        return now >= self.unavailable_until
+
+    def get_stats(self):
+        now = time.monotonic()
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'healthy': self.is_healthy(now),
+            'outstanding': self.outstanding,
+            'latency': None if self.latency is None else round(self.latency, 4),
+            'failures': self.failures,
+            'retry_in': round(max(self.unavailable_until - now, 0), 1),
+            'last_error': self.last_error,
+        }
+
+# Upstream providers with routing by load or latency and in-memory health tracking
+class ProviderPool:
+    """Pick the provider for each completion and track how the providers behave.
+
+    Providers that recently failed are tried last, after a cooldown that
+    doubles with each failure in a row, so a backend that is down costs at
+    most one failed attempt per cooldown. The SDK's own retries are turned
+    off when there is another provider to fail over to.
+    """
+
+    def __init__(self, configs, routing=PROVIDER_ROUTING, previous=None):
+        self.lock = threading.Lock()
+        self.routing = routing
+        max_retries = 0 if len(configs) > 1 else None
+        reusable = {(provider.name, provider.base_url, provider.api_key): provider for provider in (previous.providers if previous else [])}
+        self.providers = []
+        for config in configs:
+            provider = reusable.get((config['name'], config['base_url'], config['api_key']))
+            if provider is None or provider.max_retries != max_retries:
+                provider = Provider(config['name'], config['api_key'], config['base_url'], max_retries=max_retries)
+            provider.models = set(config.get('models') or [])
+            self.providers.append(provider)
+        # Replaced providers are closed once their last completion ends, or at once when idle
+        for provider in (previous.providers if previous else []):
+            if provider not in self.providers:
+                provider.is_retired = True
+                if provider.outstanding == 0:
+                    provider.close()
+
+    def candidates(self, model):
+        """Return the providers to try for model, best first."""
+        now = time.monotonic()
+        with self.lock:
+            serving = [provider for provider in self.providers if provider.serves(model)] or list(self.providers)
+            if self.routing == 'latency':
+                score = lambda provider: ((provider.latency or 0) * (provider.outstanding + 1), provider.outstanding)
+            else:
+                score = lambda provider: (provider.outstanding, provider.latency or 0)
+            return sorted(serving, key=lambda provider: (not provider.is_healthy(now), score(provider)))
+
+    def acquire(self, provider):
+        with self.lock:
+            provider.outstanding += 1
+
+    def release(self, provider):
+        with self.lock:
+            provider.outstanding -= 1
+            is_idle = provider.outstanding == 0
+        if is_idle and provider.is_retired:
+            provider.close()
+
+    def record_success(self, provider, latency=None):
+        with self.lock:
+            provider.failures = 0
+            provider.unavailable_until = 0.0
+            if latency is not None:
+                if provider.latency is None:
+                    provider.latency = latency
+                else:
+                    provider.latency += PROVIDER_LATENCY_ALPHA * (latency - provider.latency)
+
+    def record_failure(self, provider, error):
+        cooldown = PROVIDER_COOLDOWN * 2 ** min(provider.failures, 10)
+        retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('retry-after')
+        if retry_after and retry_after.isdigit():
+            cooldown = max(cooldown, int(retry_after))
+        with self.lock:
+            provider.failures += 1
+            provider.unavailable_until = time.monotonic() + min(cooldown, PROVIDER_COOLDOWN_MAX)
+            provider.last_error = str(error)[:200]
+        metrics.inc('chat_webui_provider_failures_total', {'provider': provider.name})
+
+    def get_key(self):
+        return '|'.join(f"{provider.base_url}#{hashlib.sha256(provider.api_key.encode()).hexdigest()[:16]}" for provider in self.providers)
+
+    def get_stats(self):
+        with self.lock:
+            return [provider.get_stats() for provider in self.providers]
+
+# Function to build the provider pool from the settings, keeping providers that did not change
+def build_provider_pool(settings, previous=None):
+    configs = []
+    if settings.get('api_key') and settings.get('base_url'):
+        configs.append({'name': 'default', 'api_key': settings['api_key'], 'base_url': settings['base_url']})
+    for index, config in enumerate(settings.get('providers') or []):
+        if config.get('base_url'):
+            configs.append({
+                'name': config.get('name') or f"provider-{index + 1}",
+                # Local backends often take any key, but the client needs one
+                'api_key': config.get('api_key') or 'none',
+                'base_url': config['base_url'].rstrip('/'),
+                'models': config.get('models'),
+            })
+    if not configs:
+        return None
+    return ProviderPool(configs, settings.get('routing', PROVIDER_ROUTING), previous)
+
+# Function to tell whether an upstream error should be retried on another provider
+def is_failover_error(error):
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, httpx.TransportError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
 # Function to load settings from file
 def load_settings():
-    global api_key, base_url, openai_client
+    global api_key, base_url, provider_pool
     try:
         with open(SETTINGS_FILE, 'r') as file:
             settings = json.load(file)
-            api_key = settings.get('api_key')
-            base_url = settings.get('base_url')
-            if api_key and base_url:
-                openai_client = openai.OpenAI(
-                    api_key=api_key,
-                    base_url=base_url,
-                )
     except (FileNotFoundError, json.JSONDecodeError):
-        api_key = None
-        base_url = None
-        openai_client = None
+        settings = {}
+    api_key = settings.get('api_key')
+    base_url = settings.get('base_url')
+    provider_pool = build_provider_pool(settings, provider_pool)
 
-# Function to save settings to file
+# Function to save settings to file, keeping any extra providers configured there
 def save_settings(api_key, base_url):
-    settings = {
-        'api_key': api_key,
-        'base_url': base_url
-    }
+    try:
+        with open(SETTINGS_FILE, 'r') as file:
+            settings = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        settings = {}
+    settings['api_key'] = api_key
+    settings['base_url'] = base_url
     with open(SETTINGS_FILE, 'w') as file:
         json.dump(settings, file)
 
-# Function to fetch models from the API
+# Function to fetch the models of every provider, in the order the providers are configured
 def fetch_models():
-    if not api_key or not base_url:
+    if provider_pool is None:
         return []
-    
-    models_url = f"{base_url}/models"
+    providers = provider_pool.providers
+    with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+        provider_models = list(executor.map(fetch_provider_models, providers))
+
+    models = {}
+    for provider, listed in zip(providers, provider_models):
+        # A failed listing keeps the models the provider reported before
+        if listed:
+            provider.listed_models = set(listed)
+        models.update(dict.fromkeys(model for model in listed if not provider.models or model in provider.models))
+    return list(models)
+
+# Function to fetch models from one provider's API
+def fetch_provider_models(provider):
+    models_url = f"{provider.base_url}/models"
     headers = {
-        "Authorization": f"Bearer {api_key}"
+        "Authorization": f"Bearer {provider.api_key}"
     }
     
     try:
-        response = httpx.get(models_url, headers=headers)
+        response = get_http_client().get(models_url, headers=headers)
         
         if response.status_code == 200:
             try:
@@ -101,28 +1146,145 @@ def fetch_models():
         return []
 
 
-# Function to preload models on app startup
+# Model lists per endpoint, served stale while a background refresh runs
+class ModelCatalog:
+    """Cache the model list of each endpoint with a TTL and keep it on disk.
+
+    Lists are served immediately, even when stale, and refreshed in a
+    background thread. Only an endpoint that was never fetched makes a
+    request wait, and only for MODEL_FETCH_WAIT seconds.
+    """
+
+    def __init__(self, cache_file=MODELS_CACHE_FILE, ttl=MODEL_CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refreshing = {}  # endpoint key -> threading.Event set when the refresh ends
+        try:
+            with open(cache_file, 'r') as file:
+                self.entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def get(self, wait=0):
+        endpoint = get_endpoint_key()
+        if endpoint is None:
+            return []
+        with self.lock:
+            entry = self.entries.get(endpoint)
+        if entry is None or time.time() - entry['fetched_at'] > self.ttl:
+            done = self.refresh(endpoint)
+            if entry is None and wait:
+                done.wait(wait)
+                with self.lock:
+                    entry = self.entries.get(endpoint)
+        return entry['models'] if entry else []
+
+    def is_fresh(self, endpoint):
+        with self.lock:
+            entry = self.entries.get(endpoint)
+        return entry is not None and time.time() - entry['fetched_at'] <= self.ttl
+
+    def refresh(self, endpoint=None):
+        """Start a background refresh unless one is running, returns its done event."""
+        endpoint = endpoint or get_endpoint_key()
+        with self.lock:
+            if endpoint in self.refreshing:
+                return self.refreshing[endpoint]
+            done = self.refreshing[endpoint] = threading.Event()
+        threading.Thread(target=self._refresh, args=(endpoint, done), name='model-refresh', daemon=True).start()
+        return done
+
+    def _refresh(self, endpoint, done):
+        try:
+            models = fetch_models()
+            # An empty list usually means the endpoint failed, so the last known list is kept
+            if models and endpoint == get_endpoint_key():
+                with self.lock:
+                    self.entries[endpoint] = {'models': models, 'fetched_at': time.time()}
+                    entries = dict(self.entries)
+                with open(self.cache_file, 'w') as file:
+                    json.dump(entries, file)
+        except Exception as e:
+            print(f"Failed to refresh models: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.pop(endpoint, None)
+            done.set()
+
+# Function to identify the configured endpoints without storing their API keys
+def get_endpoint_key():
+    if provider_pool is None:
+        return None
+    return provider_pool.get_key()
+
+model_catalog = ModelCatalog()
+models_preloaded = None  # done event of the startup model refresh, None when none was started
+
+# Function to preload models on app startup without blocking it, returns the refresh's done event
 def preload_models():
-    global preloaded_models
-    preloaded_models = fetch_models()
+    # A model list that is still fresh on disk is served as is, so restarts make no request
+    endpoint = get_endpoint_key()
+    if endpoint is not None and not model_catalog.is_fresh(endpoint):
+        return model_catalog.refresh(endpoint)
+    return None
+
+# Semaphore and per-host schedule shared by every search, only used on the event loop
+search_semaphore = None
+host_next_request = {}  # host -> event loop time of its next allowed request
+
+# Function to compute an exponential retry delay with jitter
+def backoff_delay(attempt):
+    delay = min(BACKOFF_MAX, RATE_LIMIT * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+# Context manager that spaces out requests per host and caps concurrent search requests
+@asynccontextmanager
+async def search_slot(url):
+    global search_semaphore
+    if search_semaphore is None:
+        search_semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+    host = urlsplit(url).hostname
+    now = asyncio.get_running_loop().time()
+    if len(host_next_request) >= HOST_SCHEDULE_MAX_ENTRIES:
+        # A host whose next slot has passed needs no entry, so only hosts fetched in the last moment stay
+        for stale_host in [key for key, next_at in host_next_request.items() if next_at <= now]:
+            del host_next_request[stale_host]
+    ready_at = max(now, host_next_request.get(host, now))
+    host_next_request[host] = ready_at + HOST_MIN_INTERVAL
+    if ready_at > now:
+        await asyncio.sleep(ready_at - now)
+
+    async with search_semaphore:
+        yield
 
 # Function to fetch search results from DuckDuckGo Lite
 async def fetch_results(session, query, results=DEFAULT_RESULTS, retries=RETRY_LIMIT):
-    url = 'https://lite.duckduckgo.com/lite/'
+    url = SEARCH_URL
     data = {
         'q': query
     }
     headers = {
         'User-Agent': USER_AGENT
     }
+    cache_key = f"search:{' '.join(query.lower().split())}"
+    cached = content_cache.get(cache_key)
+    if cached is not None and cached[2]:
+        return cached[0]
+
     for attempt in range(retries + 1):
         try:
-            async with session.post(url, data=data, headers=headers, timeout=TIMEOUT) as response:
-                response.raise_for_status()
-                return await response.text()
+            async with search_slot(url):
+                with timed('search_fetch'):
+                    async with session.post(url, data=data, headers=headers) as response:
+                        response.raise_for_status()
+                        html_content = await response.text()
+            content_cache.set(cache_key, html_content)
+            return html_content
         except aiohttp.ClientError:
             if attempt < retries:
-                await asyncio.sleep(RATE_LIMIT)
+                await asyncio.sleep(backoff_delay(attempt))
             else:
                 return None
 
@@ -151,36 +1313,130 @@ def parse_results(html_content, results=DEFAULT_RESULTS):
     print()
     countLink = 0
     return links
+# Header written before each search result or document, used to keep chunks attributed to their source
+SOURCE_HEADER_PATTERN = re.compile(r'(Source text \d+ from (?:website|document) \S+: \n \n )')
+
+# Function to format the extracted text of a search result or document
+def format_source_text(cleaned_text, index, url, source='website'):
+    return f"Source text {index} from {source} {url}: \n \n {cleaned_text} \n \n"
+
 # Function to fetch and extract text from a URL and format it
 async def fetch_and_format_text(session, url, index, retries=RETRY_LIMIT):
-    for attempt in range(retries + 1):
-        try:
-            async with session.get(url, headers={"User-Agent": USER_AGENT}, timeout=TIMEOUT) as response:
-                response.raise_for_status()
-                content_type = response.headers.get('Content-Type', '')
-                if 'text/html' not in content_type:
-                    return ""
-                tree = html.fromstring(await response.text())
-                cleaned_text = ' '.join(
-                    node.strip() for node in tree.xpath('//text()[not(ancestor::style) and not(ancestor::script) and normalize-space()]')
-                )
-                return f"Source text {index} from website {url}: \n \n {cleaned_text} \n \n"
-        except (aiohttp.ClientError, Exception):
-            if attempt < retries:
-                await asyncio.sleep(RATE_LIMIT)
-            else:
-                return ""
+    cache_key = f"page:{normalize_url(url)}"
+    cached = content_cache.get(cache_key)
+    if cached is not None and cached[2]:
+        return format_source_text(cached[0], index, url)
+
+    async def fetch():
+        # A call for the same key may have filled the cache after the check above
+        cached = content_cache.get(cache_key, count=False)
+        if cached is not None and cached[2]:
+            return cached[0]
+        headers = {"User-Agent": USER_AGENT}
+        if cached is not None:
+            headers.update(revalidation_headers(cached[1]))
+        for attempt in range(retries + 1):
+            try:
+                async with search_slot(url):
+                    with timed('page_fetch'):
+                        response = await session.get(url, headers=headers)
+                    # The body is read within the slot too, so SEARCH_CONCURRENCY caps whole page downloads
+                    async with response:
+                        if cached is not None and response.status == 304:
+                            content_cache.refresh(cache_key)
+                            return cached[0]
+                        response.raise_for_status()
+                        content_type = response.headers.get('Content-Type', '')
+                        if 'text/html' not in content_type:
+                            return ""
+                        text_stream = HTMLTextStream(encoding=response.charset)
+                        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                            if not text_stream.feed(chunk):
+                                break
+                        cleaned_text = text_stream.close()
+                content_cache.set(cache_key, cleaned_text, response_validators(response))
+                return cleaned_text
+            except (aiohttp.ClientError, Exception):
+                if attempt < retries:
+                    await asyncio.sleep(backoff_delay(attempt))
+                else:
+                    raise
+
+    # Shares the download with searches and @s webpage commands fetching the same page
+    try:
+        text = await single_flight.do_async(cache_key, fetch)
+    except Exception:
+        return ""
+    return format_source_text(text, index, url) if text else ""
 
 # Function to get DuckDuckGo search results and texts
-async def get_duckduckgo_results_and_texts(query, results=DEFAULT_RESULTS):
-    async with aiohttp.ClientSession() as session:
-        html_content = await fetch_results(session, query, results)
-        links = parse_results(html_content, results)
-        if not links:
-            return [], []
-        tasks = [fetch_and_format_text(session, link, i + 1) for i, link in enumerate(links)]
-        formatted_texts = await asyncio.gather(*tasks)
-        return links, formatted_texts
+async def get_duckduckgo_results_and_texts(query, results=DEFAULT_RESULTS, soft_deadline=SEARCH_SOFT_DEADLINE):
+    """Return the links and source texts of a search, in source order.
+
+    Once the first source is ready, slower ones get soft_deadline seconds to
+    finish, so one slow website does not hold back the answer.
+    """
+    loop = asyncio.get_running_loop()
+    pages = []
+    deadline = None
+    search = iter_batch_search([query], results)
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                page = await asyncio.wait_for(anext(search), timeout)
+            except (StopAsyncIteration, asyncio.TimeoutError):
+                break
+            pages.append(page)
+            if deadline is None:
+                deadline = loop.time() + soft_deadline
+    finally:
+        await search.aclose()
+    pages.sort(key=lambda page: page['index'])
+    return [page['url'] for page in pages], [page['text'] for page in pages]
+
+# Function to search several queries at once and yield each page as soon as it is ready
+async def iter_batch_search(queries, results=DEFAULT_RESULTS):
+    """Yield one dict per fetched page, in completion order.
+
+    All queries run concurrently, limited by the shared search semaphore and
+    per-host spacing. A URL found by several queries is fetched once, and
+    source numbers are assigned in the order pages are scheduled.
+    """
+    session = await get_aiohttp_session()
+    finished_pages = asyncio.Queue()
+    seen_urls = set()
+    source_count = 0
+    done = object()
+
+    async def fetch_page(query, link, index):
+        text = await fetch_and_format_text(session, link, index)
+        await finished_pages.put({'query': query, 'index': index, 'url': link, 'text': text})
+
+    async def search(query):
+        nonlocal source_count
+        links = parse_results(await fetch_results(session, query, results), results)
+        fetches = []
+        for link in links:
+            url_key = normalize_url(link)
+            if url_key in seen_urls:
+                continue
+            seen_urls.add(url_key)
+            source_count += 1
+            fetches.append(fetch_page(query, link, source_count))
+        report_progress('sources_found', f"Found {source_count} sources", total=source_count)
+        await asyncio.gather(*fetches, return_exceptions=True)
+
+    searches = asyncio.gather(*(search(query) for query in dict.fromkeys(queries)), return_exceptions=True)
+    searches.add_done_callback(lambda _: finished_pages.put_nowait(done))
+    fetched_count = 0
+    try:
+        while (page := await finished_pages.get()) is not done:
+            fetched_count += 1
+            report_progress('fetched_source', f"Fetched source {fetched_count}/{source_count}", done=fetched_count, total=source_count)
+            yield page
+    finally:
+        searches.cancel()
 
 # Function to handle web search command
 def handle_search_command(user_content, results=DEFAULT_RESULTS):
@@ -189,99 +1445,281 @@ def handle_search_command(user_content, results=DEFAULT_RESULTS):
         return "Please provide a search query"
     
     try:
-        links, formatted_texts = asyncio.run(get_duckduckgo_results_and_texts(query, results))
+        search_key = f"search:{' '.join(query.lower().split())}:{results}"
+        links, formatted_texts = single_flight.do(search_key, lambda: run_async(get_duckduckgo_results_and_texts(query, results)))
         if not links:
             return "No results found"
         
+        index_fetched_source(search_key, None, ''.join(formatted_texts))
         return ''.join(formatted_texts)
     except Exception as e:
         return f"An error occurred: {e}"
 
+# Precompiled patterns of the links @s commands understand, also used by the command router
+YOUTUBE_LINK_PATTERN = re.compile(
+    r'(?:https?://)?(?:www\.)?'
+    r'(?:(?:youtube\.com/(?:watch\?v=|embed/)|youtu\.be/)(?P<video_id>[a-zA-Z0-9_-]{11})|(?:youtube|youtu|youtube-nocookie)\.(?:com|be)/(?=\S))'
+    r'\S*'
+)
+YOUTUBE_ID_PATTERN = re.compile(r'[a-zA-Z0-9_-]{11}')
+ARXIV_LINK_PATTERN = re.compile(r'https?://arxiv\.org/(?P<arxiv_type>abs|pdf)/(?P<paper_id>\d+\.\d+)(?P<version>v\d+)?\S*')
+PDF_LINK_PATTERN = re.compile(r'https?://[^\s?#]+\.pdf(?:[?#]\S*)?(?!\S)', re.IGNORECASE)
+URL_PATTERN = re.compile(r'https?://\S+')
+
 # Function to handle YouTube command
-def handle_youtube_command(user_content):
-    patterns = [
-        r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([a-zA-Z0-9_-]{11})',  # URLs
-        r'^[a-zA-Z0-9_-]{11}$'  # Direct video ID
-    ]
-    
-    video_id = None
-    for pattern in patterns:
-        match = re.search(pattern, user_content)
-        if match:
-            video_id = match.group(1) if len(match.groups()) > 0 else match.group(0)
-            break
-    
+def handle_youtube_command(user_content, match=None, languages=TRANSCRIPT_LANGUAGES, bucket_seconds=TRANSCRIPT_BUCKET_SECONDS):
+    """Handle YouTube links or a bare video ID, returning the transcript text.
+
+    With bucket_seconds set the transcript is returned as one [hh:mm:ss] line
+    per bucket, trimmed to TRANSCRIPT_MAX_TOKENS, so long videos are sampled
+    across their whole length. The full text is still indexed for follow-ups.
+    """
+    match = match or YOUTUBE_LINK_PATTERN.search(user_content)
+    video_id = match.group('video_id') if match else None
+    if video_id is None and YOUTUBE_ID_PATTERN.fullmatch(user_content):
+        video_id = user_content
     if video_id:
         try:
-            # Fetch the list of available transcripts
-            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-
-            language_available = []
-            for transcript in transcript_list:
-              transcript_language = transcript.language_code
-              language_available.append(transcript_language)
-            
-            # Check if there is an English transcript available
-            if 'en' in language_available:
-                transcript = transcript_list.find_transcript(['en']).fetch()
-            else:
-                # If no English transcript, get the first available language
-                transcript = transcript_list.find_transcript([language_available[0]]).fetch()
-            
-            # Join the transcript entries into a single string with no newlines
-            transcript_text = ' '.join(entry['text'] for entry in transcript)
-            return transcript_text
+            transcript = get_transcript(video_id, languages)
         except Exception as e:
             return f"Error getting transcript: {str(e)}"
+        segments = transcript['segments']
+        index_fetched_source(f"youtube:{video_id}:{transcript['language']}", f"https://www.youtube.com/watch?v={video_id}", format_transcript(segments))
+        if bucket_seconds:
+            return format_transcript(segments, bucket_seconds, TRANSCRIPT_MAX_TOKENS or CONTEXT_TOKEN_BUDGET)
+        return format_transcript(segments)
     else:
         return "Please provide a valid YouTube URL or video ID"
 
+# Thread pool that downloads YouTube transcripts
+transcript_executor = None
+transcript_executor_lock = threading.Lock()
+
+# Function to get the transcript thread pool, starting it on first use
+def get_transcript_executor():
+    global transcript_executor
+    with transcript_executor_lock:
+        if transcript_executor is None:
+            transcript_executor = ThreadPoolExecutor(max_workers=TRANSCRIPT_WORKERS, thread_name_prefix='transcript')
+    return transcript_executor
+
+# Function to get a YouTube transcript through the content cache
+def get_transcript(video_id, languages=TRANSCRIPT_LANGUAGES):
+    """Return {'language': code, 'segments': [[start, text], ...]} for a video.
+
+    Transcripts are cached per video and language, so a request for any
+    language list that resolved to the same transcript reuses it. The download
+    runs on the transcript pool and is abandoned after TRANSCRIPT_TIMEOUT.
+    """
+    cache_key = f"youtube:{video_id}:{','.join(languages)}"
+    cached = content_cache.get(cache_key)
+    if cached is not None and cached[2]:
+        return cached[0]
+
+    def fetch():
+        future = get_transcript_executor().submit(contextvars.copy_context().run, download_transcript, video_id, languages)
+        try:
+            return future.result(TRANSCRIPT_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            raise Exception(f"Timed out after {TRANSCRIPT_TIMEOUT} seconds")
+
+    return single_flight.do(cache_key, fetch)
+
+# Function to open a requests session whose requests time out, the transcript library sets no timeout
+def create_transcript_session():
+    session = requests.Session()
+    session.request = functools.partial(session.request, timeout=(CONNECT_TIMEOUT, TRANSCRIPT_REQUEST_TIMEOUT))
+    return session
+
+# Function to list the transcripts of a video over the given session
+def list_video_transcripts(video_id, session):
+    # YouTubeTranscriptApi.list_transcripts() opens its own session, so the fetcher behind it is used directly
+    return youtube_transcript_api._transcripts.TranscriptListFetcher(session).fetch(video_id)
+
+# Function to download the transcript of a YouTube video, runs on the transcript pool
+def download_transcript(video_id, languages):
+    """Every request has a timeout, so a download the caller gave up on after
+    TRANSCRIPT_TIMEOUT ends soon after instead of holding a pool worker."""
+    with timed('transcript_fetch'), create_transcript_session() as session:
+        transcript_list = list_video_transcripts(video_id, session)
+        try:
+            transcript = transcript_list.find_transcript(languages)
+        except youtube_transcript_api.NoTranscriptFound:
+            # Fall back to the first transcript the video has
+            transcript = next(iter(transcript_list), None)
+            if transcript is None:
+                raise
+        transcript = {
+            'language': transcript.language_code,
+            'segments': [[entry['start'], entry['text']] for entry in transcript.fetch()],
+        }
+
+    # Cache under the language that was found as well, so other preferences that resolve to it hit
+    content_cache.set(f"youtube:{video_id}:{transcript['language']}", transcript)
+    content_cache.set(f"youtube:{video_id}:{','.join(languages)}", transcript)
+    return transcript
+
+# Function to turn transcript segments into prompt text
+def format_transcript(segments, bucket_seconds=0, max_tokens=None):
+    """Join segments into one text, or into [hh:mm:ss] lines of bucket_seconds each.
+
+    Bucketed transcripts over max_tokens keep evenly spaced lines, so the
+    result still spans the whole video.
+    """
+    if not bucket_seconds:
+        return ' '.join(text for _, text in segments)
+
+    buckets = {}
+    for start, text in segments:
+        buckets.setdefault(int(start // bucket_seconds), []).append(text)
+    lines = []
+    for bucket, texts in sorted(buckets.items()):
+        seconds = int(bucket * bucket_seconds)
+        lines.append(f"[{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}] {' '.join(texts)}")
+
+    if max_tokens:
+        line_tokens = [count_tokens(line, None) for line in lines]
+        total = sum(line_tokens)
+        if total > max_tokens:
+            step = total / max_tokens
+            kept = []
+            used = 0
+            for index in sorted(set(int(position * step) for position in range(math.ceil(len(lines) / step)))):
+                if index >= len(lines) or used + line_tokens[index] > max_tokens:
+                    continue
+                kept.append(lines[index])
+                used += line_tokens[index]
+            lines = kept
+    return '\n'.join(lines)
+
 
 # Function to handle webpage command
-def handle_webpage_command(user_content):
+def handle_webpage_command(user_content, match=None):
     """Handle general webpage URLs, returning the extracted text."""
-    pattern = r'https?://[^\s]+'
-    match = re.search(pattern, user_content)
+    match = match or URL_PATTERN.search(user_content)
     
     if not match:
         return None
         
     url = match.group(0)
-    try:
-        response = httpx.get(url)
-        response.raise_for_status()
-        
+
+    def parse(response):
         content_type = response.headers.get('Content-Type', '')
         if 'text/html' not in content_type:
             return ""
-        
-        tree = html.fromstring(response.content)
-        cleaned_text = ' '.join(
-            node.strip() for node in tree.xpath('//text()[not(ancestor::style) and not(ancestor::script) and normalize-space()]')
-        )
-        
-        return cleaned_text
+        return extract_text_from_chunks(response.iter_bytes(STREAM_CHUNK_SIZE), response.charset_encoding)
+
+    try:
+        text = fetch_cached(f"page:{normalize_url(url)}", url, parse)
     except (httpx.RequestError, httpx.HTTPStatusError, Exception) as e:
         raise Exception(f"An error occurred while fetching the webpage: {e}")
+    index_fetched_source(f"page:{normalize_url(url)}", url, text)
+    return text
 
-def handle_arxiv_command(user_content):
-    """Handle arXiv PDF and abstract URLs, returning the extracted text."""
-    arxiv_pattern = r'https?://arxiv\.org/(abs|pdf)/\d+\.\d+(v\d+)?'
-    arxiv_match = re.search(arxiv_pattern, user_content)
-    
-    if not arxiv_match:
-        return None
-        
-    arxiv_link = arxiv_match.group(0)
-    arxiv_type = arxiv_match.group(1)  # 'abs' or 'pdf'
-    
-    try:
-        response = httpx.get(arxiv_link)
-        response.raise_for_status()
+# Process pool used to extract PDF pages and uploaded documents in parallel
+pdf_pool = None
+pdf_pool_lock = threading.Lock()
+
+# Function to get the PDF extraction process pool, starting it on first use
+def get_pdf_pool():
+    """Workers are started fresh instead of forked from this process, which
+    already runs threads. They only need the extraction module, and the
+    startup code at the end of this file is skipped if a worker re-imports
+    the main script."""
+    global pdf_pool
+    with pdf_pool_lock:
+        if pdf_pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['extraction'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=context)
+    return pdf_pool
+
+# Function to open a PDF given as bytes or as the path of a file
+def open_pdf(pdf):
+    if isinstance(pdf, str):
+        return fitz.open(pdf)
+    return fitz.open(stream=pdf, filetype="pdf")
+
+# Function to extract PDF text page by page, in order
+def iter_pdf_pages(pdf, max_pages=PDF_MAX_PAGES):
+    """Yield (pages_done, page_count, page_texts) as batches of pages are extracted.
+
+    The PDF is given as bytes or as a file path. Large documents are split
+    into page ranges that are extracted in the process pool, and batches are
+    yielded in page order as soon as they are ready. The workers read the
+    file from disk, so PDF bytes are written to a temporary file once
+    instead of being sent to every task. Extraction stops after max_pages
+    pages when it is set.
+    """
+    with open_pdf(pdf) as pdf_document:
+        page_count = pdf_document.page_count
+        if max_pages:
+            page_count = min(page_count, max_pages)
+        if page_count < PDF_PARALLEL_MIN_PAGES:
+            for page_number in range(page_count):
+                yield page_number + 1, page_count, [pdf_document[page_number].get_text()]
+            return
+
+    temp_path = None
+    if not isinstance(pdf, str):
+        fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(pdf)
+    pool = get_pdf_pool()
+    futures = [
+        (min(start + PDF_PAGES_PER_TASK, page_count), pool.submit(extract_pdf_pages, temp_path or pdf, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    try:
+        for pages_done, future in futures:
+            yield pages_done, page_count, future.result()
+    finally:
+        for _, future in futures:
+            future.cancel()
+        if temp_path is not None:
+            os.remove(temp_path)
+
+# Function to extract the text of a whole PDF document, given as bytes or as a file path
+def extract_pdf_text(pdf, max_pages=PDF_MAX_PAGES):
+    texts = []
+    with timed('pdf_extraction'):
+        for pages_done, page_count, page_texts in iter_pdf_pages(pdf, max_pages):
+            texts.extend(page_texts)
+            report_progress('parsed_pages', f"Parsed {pages_done}/{page_count} pages", done=pages_done, total=page_count)
+    return " ".join(texts)
+
+# Function to read a streamed response body, refusing one larger than max_bytes
+def read_limited(response, max_bytes):
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise Exception(f"The download is larger than {max_bytes // (1024 * 1024)} MB")
+    content = bytearray()
+    for chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+        content += chunk
+        if len(content) > max_bytes:
+            raise Exception(f"The download is larger than {max_bytes // (1024 * 1024)} MB")
+    return bytes(content)
+
+def handle_arxiv_command(user_content, match=None):
+    """Handle arXiv PDF and abstract URLs, returning the extracted text."""
+    arxiv_match = match or ARXIV_LINK_PATTERN.search(user_content)
+    
+    if not arxiv_match:
+        return None
         
+    arxiv_type = arxiv_match.group('arxiv_type')  # 'abs' or 'pdf'
+    paper_id = arxiv_match.group('paper_id') + (arxiv_match.group('version') or '')  # a link without a version means the latest one
+    arxiv_link = f"https://arxiv.org/{arxiv_type}/{paper_id}"
+    
+    def parse(response):
+        content = read_limited(response, MAX_PAGE_BYTES if arxiv_type == 'abs' else MAX_PDF_BYTES)
         if arxiv_type == 'abs':
             # Extract abstract from HTML
-            text = response.text
+            text = content.decode(response.encoding or 'utf-8', errors='replace')
             start_marker = "Abstract:</span>"
             end_marker = "Comments:"
             start_index = text.find(start_marker) + len(start_marker)
@@ -293,12 +1731,1066 @@ def handle_arxiv_command(user_content):
             return text[start_index:end_index].strip()
         else:
             # Handle PDF
-            pdf_file = BytesIO(response.content)
-            pdf_document = fitz.open(stream=pdf_file, filetype="pdf")
-            return " ".join(page.get_text() for page in pdf_document)
-            
+            return extract_pdf_text(content)
+
+    try:
+        text = fetch_cached(f"arxiv:{arxiv_type}:{paper_id}", arxiv_link, parse, phase='arxiv_fetch')
     except Exception as e:
         raise Exception(f"Failed to process arXiv {arxiv_type}: {str(e)}")
+    index_fetched_source(f"arxiv:{arxiv_type}:{paper_id}", arxiv_link, text)
+    return text
+
+# Function to handle links to PDF documents on any site
+def handle_pdf_command(user_content, match=None):
+    """Handle URLs ending in .pdf, returning the extracted text."""
+    match = match or PDF_LINK_PATTERN.search(user_content)
+    if not match:
+        return None
+
+    url = match.group(0)
+
+    def parse(response):
+        return extract_pdf_text(read_limited(response, MAX_PDF_BYTES))
+
+    try:
+        text = fetch_cached(f"pdf:{normalize_url(url)}", url, parse, phase='pdf_fetch')
+    except Exception as e:
+        raise Exception(f"Failed to process PDF: {str(e)}")
+    index_fetched_source(f"pdf:{normalize_url(url)}", url, text)
+    return text
+
+# A source @s commands retrieve from, chosen when the message has a link it matches
+class CommandRoute:
+    def __init__(self, name, pattern, handler, stage, progress_message, subject, summary_prompt, invalid_message=None):
+        self.name = name
+        self.pattern = pattern
+        self.handler = handler  # called with the message and the route's match, returns the source text
+        self.stage = stage
+        self.progress_message = progress_message
+        self.subject = subject  # what the answer is based on, such as 'webpage content'
+        self.summary_prompt = summary_prompt  # system prompt when the message is only the link
+        self.invalid_message = invalid_message  # sent instead of a completion when the handler returns None
+
+# Router that picks the route of an @s command in one pass over the message
+class CommandRouter:
+    """Classify messages with the precompiled patterns of the registered routes.
+
+    Routes are searched in registration order and the first one with a link
+    anywhere in the message wins, so specific sources such as YouTube take
+    precedence over plain webpages, even when their link is nested inside a
+    lower route's link such as a redirect URL. Each search runs in C over
+    the whole message, which is faster than a combined pattern that has to
+    consider overlapping matches.
+    """
+
+    def __init__(self):
+        self.routes = []
+
+    def register(self, route, before=None):
+        # A route registered again replaces the one with its name
+        self.routes = [registered for registered in self.routes if registered.name != route.name]
+        names = [registered.name for registered in self.routes]
+        self.routes.insert(names.index(before) if before in names else len(self.routes), route)
+
+    def classify(self, text):
+        """Return (route, match) for the best route in text, or (None, None)."""
+        for route in self.routes:
+            match = route.pattern.search(text)
+            if match is not None:
+                return route, match
+        return None, None
+
+command_router = CommandRouter()
+
+# Function to register a source for @s commands, before the named route when it should take precedence
+def register_command(name, pattern, handler, stage, progress_message, subject, summary_prompt, invalid_message=None, before=None):
+    route = CommandRoute(name, re.compile(pattern) if isinstance(pattern, str) else pattern, handler, stage, progress_message, subject, summary_prompt, invalid_message)
+    command_router.register(route, before)
+    return route
+
+register_command(
+    'youtube', YOUTUBE_LINK_PATTERN, handle_youtube_command, 'fetching_transcript', "Fetching the video transcript", 'video transcript',
+    "You are an assistant specialized in summarizing videos. Please provide a clear, concise, and well-formatted summary of the video content.",
+)
+register_command(
+    'arxiv', ARXIV_LINK_PATTERN, handle_arxiv_command, 'fetching_paper', "Downloading the arXiv paper", 'arXiv paper',
+    "You are an assistant specialized in summarizing arXiv papers. Please provide a clear, concise, and well-formatted summary of the paper's content.",
+    "Invalid arXiv URL",
+)
+register_command(
+    'pdf', PDF_LINK_PATTERN, handle_pdf_command, 'fetching_pdf', "Downloading the PDF", 'PDF document',
+    "You are an assistant specialized in summarizing documents. Please provide a clear, concise, and well-formatted summary of the document's content.",
+    "Please provide a valid PDF URL",
+)
+register_command(
+    'webpage', URL_PATTERN, handle_webpage_command, 'fetching_page', "Fetching the webpage", 'webpage content',
+    "You are an assistant specialized in summarizing webpages. Please provide a clear, concise, and well-formatted summary of the webpage content.",
+    "Please provide a valid URL",
+)
+
+# Tokenizers loaded for each model, None when tiktoken is not installed
+tokenizers = {}
+
+# Function to get the tokenizer for a model
+def get_tokenizer(model):
+    if model not in tokenizers:
+        try:
+            import tiktoken
+            try:
+                tokenizers[model] = tiktoken.encoding_for_model(model or '')
+            except KeyError:
+                tokenizers[model] = tiktoken.get_encoding('cl100k_base')
+        except ImportError:
+            tokenizers[model] = None
+    return tokenizers[model]
+
+# Function to count the tokens of a text for a model
+def count_tokens(text, model):
+    tokenizer = get_tokenizer(model)
+    if tokenizer is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+# Function to split text into lowercase terms for ranking
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+# Function to score documents against a query with Okapi BM25
+def bm25_scores(query_terms, documents, k1=BM25_K1, b=BM25_B):
+    """Score each tokenized document against the query terms."""
+    if not documents:
+        return []
+    term_counts = []
+    document_frequency = {}
+    for terms in documents:
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        term_counts.append(counts)
+        for term in counts:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    average_length = sum(len(terms) for terms in documents) / len(documents) or 1
+    scores = []
+    for terms, counts in zip(documents, term_counts):
+        score = 0.0
+        for term in set(query_terms):
+            frequency = counts.get(term)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(terms) / average_length))
+        scores.append(score)
+    return scores
+
+# Function to split source text into chunks of roughly equal token size
+def split_into_chunks(text, chunk_tokens=CONTEXT_CHUNK_TOKENS):
+    """Split text into (header, chunk) pairs.
+
+    Search results are split per source first so every chunk keeps the
+    header that names the website it came from.
+    """
+    chunk_chars = chunk_tokens * CHARS_PER_TOKEN
+    sections = SOURCE_HEADER_PATTERN.split(text)
+    chunks = []
+    header = ''
+    for index, section in enumerate(sections):
+        if index % 2:
+            header = section
+            continue
+        words = section.split()
+        current = []
+        length = 0
+        for word in words:
+            current.append(word)
+            length += len(word) + 1
+            if length >= chunk_chars:
+                chunks.append((header, ' '.join(current)))
+                current = []
+                length = 0
+        if current:
+            chunks.append((header, ' '.join(current)))
+    return chunks
+
+# Function to get the source text budget for a model
+def get_context_budget(model):
+    return MODEL_CONTEXT_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+
+# Function to pack the most relevant source text into the token budget
+def pack_context(text, query, model, budget=None):
+    """Return the parts of text that best answer query within the token budget.
+
+    Text that already fits is returned unchanged. Otherwise it is split into
+    chunks that are ranked with BM25 against the query and added best first
+    until the budget is full. Selected chunks keep their original order. A
+    query without terms, such as a bare summary request, keeps the leading
+    chunks.
+    """
+    budget = budget or get_context_budget(model)
+    if count_tokens(text, model) <= budget:
+        return text
+
+    # Small budgets get smaller chunks so at least a few passages still fit
+    chunks = split_into_chunks(text, min(CONTEXT_CHUNK_TOKENS, max(budget // 4, 16)))
+    query_terms = tokenize(query) if isinstance(query, str) else []
+    scores = bm25_scores(query_terms, [tokenize(chunk) for _, chunk in chunks])
+    ranked = sorted(range(len(chunks)), key=lambda index: (-scores[index], index))
+
+    selected = []
+    used = 0
+    for index in ranked:
+        header, chunk = chunks[index]
+        tokens = count_tokens(chunk, model) + (count_tokens(header, model) if header else 0)
+        if used + tokens > budget:
+            continue
+        selected.append(index)
+        used += tokens
+
+    packed = []
+    last_header = None
+    for index in sorted(selected):
+        header, chunk = chunks[index]
+        if header and header != last_header:
+            packed.append(header + chunk)
+        else:
+            packed.append(chunk)
+        last_header = header
+    return ' \n \n '.join(packed)
+
+# Error raised when a client's conversation version is behind the stored one
+class ConversationVersionError(Exception):
+    def __init__(self, version):
+        super().__init__(f"Conversation is at version {version}")
+        self.version = version
+
+# SQLite backed conversation history with an in-memory LRU of active conversations
+class ConversationStore:
+    """Keep conversation histories on the server so clients only send new messages.
+
+    Every change bumps the conversation version. Clients send the version
+    they last saw, and a stale version is rejected so the client can resend
+    its full history to resynchronize.
+    """
+
+    def __init__(self, db_file=CONVERSATIONS_DB_FILE, cache_size=CONVERSATION_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.conversations = OrderedDict()  # conversation ID -> (version, messages)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS conversations '
+            '(id TEXT PRIMARY KEY, version INTEGER, messages TEXT, updated_at REAL)'
+        )
+        self.db.commit()
+
+    def get(self, conversation_id):
+        """Return (version, messages) for a conversation, (0, []) if it is unknown."""
+        with self.lock:
+            version, messages = self._load(conversation_id)
+            return version, list(messages)
+
+    def replace(self, conversation_id, messages):
+        with self.lock:
+            version, _ = self._load(conversation_id)
+            return self._save(conversation_id, version + 1, list(messages))
+
+    def append(self, conversation_id, new_messages, expected_version=None, continue_last=False):
+        """Append messages and return the new version.
+
+        With continue_last, assistant text is added to the last assistant
+        message instead, which is how continued generations are stored.
+        """
+        with self.lock:
+            version, messages = self._load(conversation_id)
+            if expected_version is not None and expected_version != version:
+                raise ConversationVersionError(version)
+            messages = list(messages)
+            for message in new_messages:
+                if continue_last and messages and messages[-1].get('role') == 'assistant' == message.get('role'):
+                    messages[-1] = dict(messages[-1], content=messages[-1].get('content', '') + message['content'])
+                else:
+                    messages.append(message)
+            return self._save(conversation_id, version + 1, messages)
+
+    def delete(self, conversation_id):
+        with self.lock:
+            self.conversations.pop(conversation_id, None)
+            self.db.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,))
+            self.db.commit()
+
+    def _load(self, conversation_id):
+        if conversation_id in self.conversations:
+            self.conversations.move_to_end(conversation_id)
+            return self.conversations[conversation_id]
+        row = self.db.execute('SELECT version, messages FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+        entry = (row[0], json.loads(row[1])) if row else (0, [])
+        self._remember(conversation_id, entry)
+        return entry
+
+    def _save(self, conversation_id, version, messages):
+        messages = trim_conversation(messages)
+        self._remember(conversation_id, (version, messages))
+        self.db.execute(
+            'INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)',
+            (conversation_id, version, json.dumps(messages), time.time())
+        )
+        self.db.commit()
+        return version
+
+    def _remember(self, conversation_id, entry):
+        self.conversations[conversation_id] = entry
+        self.conversations.move_to_end(conversation_id)
+        while len(self.conversations) > self.cache_size:
+            self.conversations.popitem(last=False)
+
+# Function to drop the oldest messages of a conversation that exceeds the size limits
+def trim_conversation(messages):
+    messages = messages[-CONVERSATION_MAX_MESSAGES:]
+    total_chars = sum(len(json.dumps(message.get('content', ''))) for message in messages)
+    start = 0
+    while total_chars > CONVERSATION_MAX_CHARS and start < len(messages) - 1:
+        total_chars -= len(json.dumps(messages[start].get('content', '')))
+        start += 1
+    return messages[start:]
+
+# Store for conversations that clients choose to keep on the server
+conversation_store = None
+conversation_store_lock = threading.Lock()
+
+# Function to get the conversation store, opening its database on first use
+def get_conversation_store():
+    global conversation_store
+    with conversation_store_lock:
+        if conversation_store is None:
+            conversation_store = ConversationStore()
+    return conversation_store
+
+# Error raised when an upload cannot be stored, with the HTTP status to answer with
+class DocumentError(Exception):
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.status = status
+
+# SQLite backed store of uploaded documents and their text chunks, keyed by content hash
+class DocumentStore:
+    """Keep the extracted text of uploads so chats can refer to them by ID.
+
+    A document's ID is the SHA-256 of its bytes, so uploading the same file
+    again finds the stored copy instead of parsing it again.
+    """
+
+    def __init__(self, db_file=DOCUMENTS_DB_FILE):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS documents '
+            '(id TEXT PRIMARY KEY, filename TEXT, kind TEXT, size INTEGER, chunks INTEGER, chars INTEGER, path TEXT, created_at REAL)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS document_chunks '
+            '(document_id TEXT, position INTEGER, text TEXT, PRIMARY KEY (document_id, position))'
+        )
+        self.db.commit()
+
+    def get(self, document_id):
+        """Return the metadata of a document, None if it is unknown."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id, filename, kind, size, chunks, chars, created_at FROM documents WHERE id = ?', (document_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('documentId', 'filename', 'kind', 'size', 'chunks', 'chars', 'createdAt'), row))
+
+    def get_chunks(self, document_id):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT text FROM document_chunks WHERE document_id = ? ORDER BY position', (document_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, document_id, filename, kind, size, path, chunks):
+        with self.lock:
+            self.db.execute('DELETE FROM document_chunks WHERE document_id = ?', (document_id,))
+            self.db.executemany(
+                'INSERT INTO document_chunks VALUES (?, ?, ?)',
+                [(document_id, position, chunk) for position, chunk in enumerate(chunks)]
+            )
+            self.db.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (document_id, filename, kind, size, len(chunks), sum(len(chunk) for chunk in chunks), path, time.time())
+            )
+            self.db.commit()
+        return self.get(document_id)
+
+    def delete(self, document_id):
+        """Forget a document and return the path of its file, None if it is unknown."""
+        with self.lock:
+            row = self.db.execute('SELECT path FROM documents WHERE id = ?', (document_id,)).fetchone()
+            self.db.execute('DELETE FROM document_chunks WHERE document_id = ?', (document_id,))
+            self.db.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+            self.db.commit()
+        return row[0] if row else None
+
+# Store for uploaded documents
+document_store = None
+document_store_lock = threading.Lock()
+
+# Function to get the document store, opening its database on first use
+def get_document_store():
+    global document_store
+    with document_store_lock:
+        if document_store is None:
+            document_store = DocumentStore()
+    return document_store
+
+# Function to tell the kind of an upload from its file name, or else its content type
+def get_document_kind(filename, content_type):
+    extension = os.path.splitext(filename or '')[1].lower()
+    kinds = {'.pdf': 'pdf', '.docx': 'docx', '.html': 'html', '.htm': 'html', '.txt': 'text', '.md': 'text', '.csv': 'text', '.json': 'text'}
+    if extension in kinds:
+        return kinds[extension]
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type == 'application/pdf':
+        return 'pdf'
+    if content_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+        return 'docx'
+    if content_type in ('text/html', 'application/xhtml+xml'):
+        return 'html'
+    if content_type.startswith('text/'):
+        return 'text'
+    return None
+
+# Function to extract the text of an uploaded file
+def parse_document(path, kind):
+    """PDF pages are spread over the process pool by extract_pdf_text, other
+    kinds are parsed whole in one worker so the request thread stays free."""
+    with timed('document_parsing'):
+        if kind == 'pdf':
+            text = extract_pdf_text(path)
+        else:
+            text = get_pdf_pool().submit(extract_document_text, path, kind, DOCUMENT_MAX_CHARS).result()
+    return text[:DOCUMENT_MAX_CHARS]
+
+# Function to save an upload to disk while hashing it, then parse and store it unless it is already known
+def ingest_document(stream, filename, kind):
+    """Return (document, is_new) for an uploaded file.
+
+    The upload is copied to disk chunk by chunk, so it is never held in
+    memory whole, and the copy is dropped again when the same bytes were
+    uploaded before.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            while chunk := stream.read(STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise DocumentError(f"Documents are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB", 413)
+                digest.update(chunk)
+                file.write(chunk)
+        document_id = digest.hexdigest()
+        store = get_document_store()
+        document = store.get(document_id)
+        if document is not None:
+            return document, False
+
+        is_stored = False
+
+        def store_document():
+            nonlocal is_stored
+            # An identical upload may have been stored after the check above
+            document = store.get(document_id)
+            if document is not None:
+                return document
+            path = os.path.join(UPLOAD_DIR, document_id + DOCUMENT_EXTENSIONS[kind])
+            os.replace(temp_path, path)
+            try:
+                text = parse_document(path, kind)
+            except Exception as e:
+                os.remove(path)
+                raise DocumentError(f"Failed to parse the document: {e}")
+            chunks = [chunk for _, chunk in split_into_chunks(text)]
+            if not chunks:
+                os.remove(path)
+                raise DocumentError("No text found in the document")
+            document = store.add(document_id, filename, kind, size, path, chunks)
+            is_stored = True
+            return document
+
+        # Identical uploads arriving together are parsed once, and only the one that stored it reports it as new
+        document = single_flight.do(f"document:{document_id}", store_document)
+        return document, is_stored
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Function to format stored documents as source text for a chat message
+def format_documents(documents):
+    store = get_document_store()
+    return ''.join(
+        format_source_text(' '.join(store.get_chunks(document['documentId'])), index, '_'.join((document['filename'] or document['documentId'][:12]).split()), 'document')
+        for index, document in enumerate(documents, 1)
+    )
+
+# Full-text index over fetched sources so follow-up questions get the relevant chunks back
+class RetrievalIndex:
+    """Index source text in chunks under a scope, such as a conversation ID.
+
+    Chunks are ranked with SQLite FTS5's BM25. When SQLite was built without
+    FTS5 the chunks are kept in memory instead and ranked with the BM25 used
+    for context packing, so the index then lasts until the server restarts.
+    """
+
+    def __init__(self, db_file=RETRIEVAL_DB_FILE, max_sources=RETRIEVAL_MAX_SOURCES):
+        self.max_sources = max_sources
+        self.lock = threading.Lock()
+        self.memory = None
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        try:
+            self.db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(text, header UNINDEXED, source_id UNINDEXED, scope UNINDEXED)')
+        except sqlite3.OperationalError:
+            self.db.close()
+            self.db = sqlite3.connect(':memory:', check_same_thread=False)
+            self.memory = {}  # scope -> [(source ID, header, text, terms)]
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS sources '
+            '(id INTEGER PRIMARY KEY, scope TEXT, source_key TEXT, created_at REAL, UNIQUE (scope, source_key))'
+        )
+        self.db.commit()
+
+    def add(self, scope, source_key, text):
+        """Index text under scope unless that source is already there, returns whether it was added."""
+        chunks = [(header, chunk) for header, chunk in split_into_chunks(text) if chunk]
+        with self.lock:
+            if self.db.execute('SELECT 1 FROM sources WHERE scope = ? AND source_key = ?', (scope, source_key)).fetchone():
+                return False
+            source_id = self.db.execute(
+                'INSERT INTO sources (scope, source_key, created_at) VALUES (?, ?, ?)', (scope, source_key, time.time())
+            ).lastrowid
+            if self.memory is None:
+                self.db.executemany(
+                    'INSERT INTO chunks (text, header, source_id, scope) VALUES (?, ?, ?, ?)',
+                    [(chunk, header, source_id, scope) for header, chunk in chunks]
+                )
+            else:
+                self.memory.setdefault(scope, []).extend((source_id, header, chunk, tokenize(chunk)) for header, chunk in chunks)
+            expired = [row[0] for row in self.db.execute(
+                'SELECT id FROM sources WHERE scope = ? ORDER BY created_at DESC, id DESC LIMIT -1 OFFSET ?', (scope, self.max_sources)
+            )]
+            self._delete_sources(scope, expired)
+            self.db.commit()
+        return True
+
+    def search(self, scope, query, top_k=RETRIEVAL_TOP_K):
+        """Return up to top_k (header, text) chunks of scope that best match query, best first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self.lock:
+            if self.memory is None:
+                match = ' OR '.join(f'"{term}"' for term in terms)
+                return self.db.execute(
+                    'SELECT header, text FROM chunks WHERE chunks MATCH ? AND scope = ? ORDER BY bm25(chunks) LIMIT ?',
+                    (match, scope, top_k)
+                ).fetchall()
+            entries = self.memory.get(scope, [])
+            scores = bm25_scores(terms, [entry[3] for entry in entries])
+            ranked = sorted((index for index in range(len(entries)) if scores[index] > 0), key=lambda index: -scores[index])
+            return [(entries[index][1], entries[index][2]) for index in ranked[:top_k]]
+
+    def has_sources(self, scope):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM sources WHERE scope = ? LIMIT 1', (scope,)).fetchone() is not None
+
+    def delete_scope(self, scope):
+        with self.lock:
+            source_ids = [row[0] for row in self.db.execute('SELECT id FROM sources WHERE scope = ?', (scope,))]
+            self._delete_sources(scope, source_ids)
+            self.db.commit()
+
+    def _delete_sources(self, scope, source_ids):
+        if not source_ids:
+            return
+        placeholders = ','.join('?' * len(source_ids))
+        self.db.execute(f'DELETE FROM sources WHERE id IN ({placeholders})', source_ids)
+        if self.memory is None:
+            self.db.execute(f'DELETE FROM chunks WHERE source_id IN ({placeholders})', source_ids)
+        else:
+            removed = set(source_ids)
+            self.memory[scope] = [entry for entry in self.memory.get(scope, []) if entry[0] not in removed]
+
+# Index of the sources fetched for chats
+retrieval_index = None
+retrieval_index_lock = threading.Lock()
+
+# Function to get the retrieval index, opening its database on first use
+def get_retrieval_index():
+    global retrieval_index
+    with retrieval_index_lock:
+        if retrieval_index is None:
+            retrieval_index = RetrievalIndex()
+    return retrieval_index
+
+# Function to index text fetched for the current request under its retrieval scope
+def index_fetched_source(source_key, url, text):
+    scope = retrieval_scope.get()
+    if scope is None or not text:
+        return
+    # Sources without per-result headers get one so their chunks stay attributed
+    if url is not None and not SOURCE_HEADER_PATTERN.match(text):
+        text = format_source_text(text, 1, url)
+    try:
+        with timed('indexing'):
+            get_retrieval_index().add(scope, source_key, text)
+    except sqlite3.Error as e:
+        print(f"Failed to index {source_key}: {e}")
+
+# Function to format the chunks found for a follow-up question as source text
+def format_retrieved_chunks(chunks):
+    return ''.join(f"{header}{text} \n \n " for header, text in chunks)
+
+# Function to stream completion deltas from the upstream model, failing over between providers
+async def stream_completion(selected_model, messages, parameters):
+    """Yield the content deltas of a streamed completion.
+
+    A rate limit, server error or connection failure moves on to the next
+    provider as long as nothing has been sent yet. Once the first delta is
+    out, errors are raised as usual so the text is never duplicated.
+    """
+    loop = asyncio.get_running_loop()
+    # The pool is kept for the whole stream, a settings change may replace the global one meanwhile
+    pool = provider_pool
+    candidates = pool.candidates(selected_model)
+    for index, provider in enumerate(candidates):
+        is_started = False
+        has_output = False
+        start = loop.time()
+        pool.acquire(provider)
+        try:
+            # The raw stream is parsed here, building the SDK's chunk objects costs more than the rest of the stream
+            async with provider.client.chat.completions.with_streaming_response.create(
+                model=selected_model,
+                messages=messages,
+                stream=True,
+                **(parameters or {})
+            ) as response:
+                async for chunk in iter_completion_chunks(response):
+                    if not is_started:
+                        is_started = True
+                        pool.record_success(provider, loop.time() - start)
+                    choices = chunk.get('choices')
+                    content = (choices[0].get('delta') or {}).get('content') if choices else None
+                    if content is None:
+                        continue
+                    has_output = True
+                    yield content
+            return
+        except Exception as e:
+            if not is_failover_error(e):
+                raise
+            pool.record_failure(provider, e)
+            if has_output or index == len(candidates) - 1:
+                raise
+            print(f"Provider {provider.name} failed, trying {candidates[index + 1].name}: {e}")
+        finally:
+            pool.release(provider)
+
+# Function to parse the chunks of a raw streamed completion
+async def iter_completion_chunks(response):
+    async for line in response.iter_lines():
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
+        chunk = json.loads(data)
+        if chunk.get('error'):
+            error = chunk['error']
+            raise openai.APIError(error.get('message', str(error)) if isinstance(error, dict) else str(error), response.http_request, body=error)
+        yield chunk
+
+# Function to group deltas that arrive close together into a single write
+async def coalesce_deltas(deltas, interval=STREAM_FLUSH_INTERVAL, max_bytes=STREAM_FLUSH_BYTES):
+    """Yield the text of deltas batched over at most interval seconds.
+
+    The first delta is sent at once so the time to first token is not
+    delayed. A batch is also sent early once it holds max_bytes. Deltas are
+    read by one task per stream and only a batch costs a wakeup, so
+    streams with many small deltas stay cheap on the event loop.
+    """
+    if not interval:
+        async for delta in deltas:
+            yield delta
+        return
+
+    pending = []
+    pending_bytes = 0
+    is_finished = False
+    has_deltas = asyncio.Event()  # set while deltas are waiting or once the source is done
+    is_full = asyncio.Event()  # set when the waiting deltas should go out at once
+
+    async def pump():
+        nonlocal pending_bytes, is_finished
+        try:
+            async for delta in deltas:
+                pending.append(delta)
+                pending_bytes += len(delta.encode())
+                has_deltas.set()
+                if pending_bytes >= max_bytes:
+                    is_full.set()
+        finally:
+            is_finished = True
+            has_deltas.set()
+            is_full.set()
+
+    pumping = asyncio.ensure_future(pump())
+    is_first = True
+    try:
+        while True:
+            await has_deltas.wait()
+            if not is_first and not is_full.is_set():
+                try:
+                    await asyncio.wait_for(is_full.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+            is_first = False
+            batch = ''.join(pending)
+            pending.clear()
+            pending_bytes = 0
+            if not is_finished:
+                has_deltas.clear()
+                is_full.clear()
+            if batch:
+                yield batch
+            if is_finished and not pending:
+                break
+        # Errors of the source are raised once the text before them is out
+        await pumping
+    finally:
+        pumping.cancel()
+        await asyncio.gather(pumping, return_exceptions=True)
+        await deltas.aclose()
+
+# Cache of completions that always give the same answer for the same input
+completion_cache = ContentCache(COMPLETION_CACHE_MAX_ENTRIES, COMPLETION_CACHE_TTL, COMPLETION_CACHE_DB_FILE, max_bytes=COMPLETION_CACHE_MAX_BYTES)
+
+# Title generations running in the background, by completion cache key
+pending_titles = {}
+title_semaphore = None
+
+# Function to build the cache key of a completion request
+def completion_cache_key(selected_model, messages, parameters):
+    payload = json.dumps({'model': selected_model, 'messages': messages, 'parameters': parameters}, sort_keys=True)
+    return f"completion:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+# Function to get a non-streaming completion, served from the cache when it is deterministic
+async def create_cached_completion(selected_model, messages, **parameters):
+    """Return the completion text, caching it when temperature is 0."""
+    is_deterministic = parameters.get('temperature') == 0
+    cache_key = completion_cache_key(selected_model, messages, parameters)
+    if is_deterministic:
+        cached = completion_cache.get(cache_key)
+        if cached is not None and cached[2]:
+            return cached[0]
+
+    pool = provider_pool
+    candidates = pool.candidates(selected_model)
+    for index, provider in enumerate(candidates):
+        pool.acquire(provider)
+        try:
+            response = await provider.client.chat.completions.create(
+                model=selected_model,
+                messages=messages,
+                **parameters
+            )
+            pool.record_success(provider)
+            break
+        except Exception as e:
+            if not is_failover_error(e):
+                raise
+            pool.record_failure(provider, e)
+            if index == len(candidates) - 1:
+                raise
+            print(f"Provider {provider.name} failed, trying {candidates[index + 1].name}: {e}")
+        finally:
+            pool.release(provider)
+    text = response.choices[0].message.content
+    if is_deterministic:
+        completion_cache.set(cache_key, text)
+    return text
+
+# Function to generate a title on the event loop, limited so it does not crowd out chat streams
+async def generate_title_in_background(selected_model, messages):
+    global title_semaphore
+    if title_semaphore is None:
+        title_semaphore = asyncio.Semaphore(TITLE_CONCURRENCY)
+    async with title_semaphore:
+        return await create_cached_completion(selected_model, messages, temperature=0)
+
+# Function to forget a finished background title generation and report its failure
+def finish_background_title(title_id, future):
+    pending_titles.pop(title_id, None)
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error generating title: {future.exception()}")
+
+# Function to build a response that streams the chunks of an async generator
+def async_streaming_response(chunks, **kwargs):
+    """Return a Response for chunks, an async generator of str or bytes.
+
+    WSGI servers get the chunks through iterate_async, which still holds one
+    server thread per response. asgi_app sends async_chunks straight from the
+    event loop instead, so a stream holds no thread at all.
+    """
+    response = Response(iterate_async(chunks), **kwargs)
+    response.async_chunks = chunks
+    return response
+
+# Function to build the streaming response shared by chat and continue generation
+def stream_chat_response(selected_model, messages, parameters, on_complete=None, headers=None, request_log=None, stream_format='text', on_close=None):
+    """Stream the completion to the client.
+
+    stream_format is 'text' for the bare generated text, 'ndjson' for JSON
+    lines with progress events, or 'sse' for resumable Server-Sent Events.
+
+    messages may also be a function that builds them. It then runs on the
+    retrieval pool once the stream has started, and its progress events are
+    sent while it works. If it returns a string, that string is sent instead
+    of a completion.
+
+    on_complete is called with the generated text once the stream ends,
+    including when the client disconnects early. request_log collects the
+    request's phase timings and is written as one JSON log line at the end.
+    on_close is called once the stream is over and no longer uses a slot.
+    """
+    request_log = request_log if request_log is not None else {}
+    # The request's context variables, such as its phase timings, outlive the request context
+    context = contextvars.copy_context()
+
+    async def generate_events():
+        if provider_pool is None:
+            yield 'delta', "Please set your API key and base URL in the settings."
+            return
+
+        deltas = []
+        start = None
+        first_token_at = None
+        try:
+            stream_messages = messages
+            if callable(messages):
+                async for kind, payload in run_with_progress(messages, context):
+                    if kind == 'result':
+                        stream_messages = payload
+                    else:
+                        yield kind, payload
+                if isinstance(stream_messages, str):
+                    yield 'delta', stream_messages
+                    return
+            yield 'progress', {'stage': 'generating', 'message': "Waiting for the model"}
+
+            start = time.perf_counter()
+            async for delta in coalesce_deltas(stream_completion(selected_model, stream_messages, parameters)):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                deltas.append(delta)
+                yield 'delta', delta
+        except Exception as e:
+            metrics.inc('chat_webui_stream_errors_total')
+            request_log['error'] = str(e)
+            yield 'delta', f"An error occurred: {str(e)}"
+        finally:
+            log_stream(request_log, selected_model, start or time.perf_counter(), first_token_at, deltas)
+            if on_complete is not None and deltas:
+                on_complete(''.join(deltas))
+
+    if stream_format == 'sse':
+        # The stream is produced on the event loop independently of this response so a client can resume it
+        stream_id, stream_buffer = live_streams.create()
+        async def produce():
+            try:
+                await stream_buffer.produce(generate_events())
+            finally:
+                if on_close is not None:
+                    on_close()
+
+        asyncio.run_coroutine_threadsafe(produce(), get_event_loop())
+        headers = dict(headers or {}, **{'X-Stream-Id': stream_id, 'Cache-Control': 'no-cache'})
+        return async_streaming_response(iter_sse(stream_buffer), mimetype='text/event-stream', headers=headers)
+
+    # Bare text is not framed as events, so it is labelled as plain text and kept out of proxy buffers
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/plain'
+    headers = dict(headers or {}, **{'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response = async_streaming_response(encode_stream_events(generate_events(), stream_format), mimetype=mimetype, headers=headers)
+    if on_close is not None:
+        response.call_on_close(on_close)
+    return response
+
+# Function to encode stream events for the client
+async def encode_stream_events(events, stream_format):
+    """Plain text clients only receive the generated text, ndjson clients receive
+    one JSON object per line for both progress and text events."""
+    async for kind, payload in events:
+        if stream_format == 'ndjson':
+            event = dict(payload) if kind == 'progress' else {'content': payload}
+            event['type'] = kind
+            yield json.dumps(event) + '\n'
+        elif kind == 'delta':
+            yield payload
+
+# Events of one SSE stream, kept after the client leaves so it can resume
+class StreamBuffer:
+    """Only used on the event loop, by the producer and by every reader."""
+
+    def __init__(self):
+        self.events = []  # event i has ID i + 1
+        self.condition = asyncio.Condition()
+        self.finished_at = None
+
+    async def produce(self, events):
+        try:
+            async for kind, payload in events:
+                async with self.condition:
+                    self.events.append((kind, payload))
+                    self.condition.notify_all()
+        finally:
+            async with self.condition:
+                self.finished_at = time.time()
+                self.condition.notify_all()
+
+    async def read(self, last_event_id, timeout):
+        """Wait up to timeout for events after last_event_id, returns (events, is_finished)."""
+        async with self.condition:
+            try:
+                await asyncio.wait_for(self.condition.wait_for(lambda: len(self.events) > last_event_id or self.finished_at is not None), timeout)
+            except asyncio.TimeoutError:
+                pass
+            new_events = [(event_id, kind, payload) for event_id, (kind, payload) in enumerate(self.events[last_event_id:], last_event_id + 1)]
+            return new_events, self.finished_at is not None
+
+# Registry of SSE streams that can be resumed by ID
+class LiveStreams:
+    def __init__(self, max_streams=SSE_MAX_STREAMS, ttl=SSE_STREAM_TTL):
+        self.max_streams = max_streams
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.streams = OrderedDict()  # stream ID -> StreamBuffer
+
+    def create(self):
+        stream_id = uuid.uuid4().hex
+        stream_buffer = StreamBuffer()
+        with self.lock:
+            now = time.time()
+            for expired_id in [key for key, value in self.streams.items() if value.finished_at and now - value.finished_at > self.ttl]:
+                del self.streams[expired_id]
+            while len(self.streams) >= self.max_streams:
+                self.streams.popitem(last=False)
+            self.streams[stream_id] = stream_buffer
+        return stream_id, stream_buffer
+
+    def get(self, stream_id):
+        with self.lock:
+            return self.streams.get(stream_id)
+
+live_streams = LiveStreams()
+
+# Function to frame one stream event as a Server-Sent Event
+def format_sse_event(event_id, kind, payload):
+    if kind == 'progress':
+        return f"id: {event_id}\nevent: progress\ndata: {json.dumps(payload)}\n\n"
+    # SSE ends a line at CR, LF or CRLF, so a bare CR in the text must start a new data line too
+    data = '\n'.join(f"data: {line}" for line in SSE_LINE_BREAK_PATTERN.split(payload))
+    return f"id: {event_id}\n{data}\n\n"
+
+# Function to send the events of a stream buffer as Server-Sent Events
+async def iter_sse(stream_buffer, last_event_id=0):
+    """Yield SSE frames after last_event_id until the stream ends.
+
+    Everything that is ready is sent in one write, and a comment line is
+    sent when the stream is idle so proxies keep the connection open.
+    """
+    while True:
+        events, is_finished = await stream_buffer.read(last_event_id, SSE_HEARTBEAT_INTERVAL)
+        if events:
+            last_event_id = events[-1][0]
+            yield ''.join(format_sse_event(*event) for event in events)
+        elif not is_finished:
+            yield ": heartbeat\n\n"
+        if is_finished and last_event_id == len(stream_buffer.events):
+            yield "event: done\ndata: \n\n"
+            return
+
+# Function to run a function on the retrieval pool, yielding its progress events and then its result
+async def run_with_progress(fn, context):
+    """Yield ('progress', event) while fn runs and ('result', value) once it returns."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def run():
+        progress_reporter.set(lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+        return fn()
+
+    future = asyncio.wrap_future(get_retrieval_executor().submit(context.run, run))
+    while not future.done():
+        next_event = asyncio.ensure_future(events.get())
+        await asyncio.wait({next_event, future}, return_when=asyncio.FIRST_COMPLETED)
+        if next_event.done():
+            yield 'progress', next_event.result()
+        else:
+            next_event.cancel()
+    # Events reported just before fn returned are still queued
+    while not events.empty():
+        yield 'progress', events.get_nowait()
+    yield 'result', future.result()
+
+# Function to record the metrics of a finished stream and write its log line
+def log_stream(request_log, selected_model, start, first_token_at, deltas):
+    end = time.perf_counter()
+    duration = end - start
+    metrics.observe('chat_webui_stream_duration_seconds', duration)
+    request_log.update(model=selected_model, stream_seconds=round(duration, 6), writes=len(deltas))
+    if first_token_at is not None:
+        ttft = first_token_at - start
+        tokens = count_tokens(''.join(deltas), selected_model)
+        metrics.observe('chat_webui_upstream_ttft_seconds', ttft)
+        request_log.update(ttft_seconds=round(ttft, 6), tokens=tokens)
+        if end > first_token_at:
+            tokens_per_second = tokens / (end - first_token_at)
+            metrics.observe('chat_webui_stream_tokens_per_second', tokens_per_second, buckets=RATE_BUCKETS)
+            request_log['tokens_per_second'] = round(tokens_per_second, 2)
+    logger.info(json.dumps(request_log))
+
+# Function to load the stored history for a request that uses a server-side conversation
+def load_stored_conversation(conversation_id, conversation_history):
+    """Return (version, history) or raise ConversationVersionError.
+
+    A request that still includes its full history resynchronizes the store.
+    Otherwise the client's version must match the stored one.
+    """
+    store = get_conversation_store()
+    if 'conversation' in request.json:
+        store.replace(conversation_id, conversation_history)
+    version, history = store.get(conversation_id)
+    client_version = request.json.get('version')
+    if 'conversation' not in request.json and client_version is not None and client_version != version:
+        raise ConversationVersionError(version)
+    return version, history
+
+# Function to save a finished exchange to the conversation store
+def save_stored_exchange(conversation_id, version, new_messages, continue_last=False):
+    try:
+        get_conversation_store().append(conversation_id, new_messages, version, continue_last)
+    except ConversationVersionError as e:
+        print(f"Conversation {conversation_id} changed while streaming: {e}")
+
+# Clear the phase timings of a request once it has been handled
+@app.teardown_request
+def clear_request_timings(exception=None):
+    request_timings.set(None)
+    retrieval_scope.set(None)
 
 # Route to render the index page
 @app.route('/')
@@ -308,32 +2800,204 @@ def index():
 # Route to fetch models
 @app.route('/fetch-models', methods=['GET'])
 def fetch_models_route():
-    return jsonify(preloaded_models)
+    response = jsonify(model_catalog.get(wait=MODEL_FETCH_WAIT))
+    response.cache_control.no_cache = True  # the browser keeps the list but revalidates it with the ETag
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Route to report outbound connection pool statistics
+@app.route('/pool-stats', methods=['GET'])
+def pool_stats_route():
+    return jsonify(get_pool_stats())
+
+# Route to report the health and load of each upstream provider
+@app.route('/provider-stats', methods=['GET'])
+def provider_stats_route():
+    return jsonify(provider_pool.get_stats() if provider_pool else [])
+
+# Route to report content cache statistics
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify(content_cache.get_stats())
+
+# Route to delete a server-side conversation
+@app.route('/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation_route(conversation_id):
+    get_conversation_store().delete(conversation_id)
+    get_retrieval_index().delete_scope(conversation_id)
+    return jsonify({"status": "success"})
+
+# Route to upload a document that chats can then refer to by its ID
+@app.route('/documents', methods=['POST'])
+def upload_document_route():
+    """Accept a multipart upload in the 'file' field, or the raw file as the
+    request body with its name in the 'filename' query parameter. Raw bodies
+    are streamed straight to disk."""
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, request.args.get('filename', ''), request.mimetype
+    kind = get_document_kind(filename, content_type)
+    if kind is None:
+        return jsonify({"error": "Unsupported document type, upload a PDF, DOCX, HTML or text file"}), 415
+    try:
+        ticket = admit_request(retrieval_gate)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    try:
+        document, is_new = ingest_document(stream, filename, kind)
+    except DocumentError as e:
+        return jsonify({"error": str(e)}), e.status
+    finally:
+        ticket.release()
+    metrics.inc('chat_webui_documents_total', {'kind': kind, 'result': 'stored' if is_new else 'duplicate'})
+    return jsonify(dict(document, duplicate=not is_new)), 201 if is_new else 200
+
+# Route to get the metadata of an uploaded document
+@app.route('/documents/<document_id>', methods=['GET'])
+def get_document_route(document_id):
+    document = get_document_store().get(document_id)
+    if document is None:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify(document)
+
+# Route to delete an uploaded document and its file
+@app.route('/documents/<document_id>', methods=['DELETE'])
+def delete_document_route(document_id):
+    path = get_document_store().delete(document_id)
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+    return jsonify({"status": "success"})
+
+# Route to expose request metrics in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    for client_name, counters in get_pool_stats().items():
+        if isinstance(counters, dict):
+            for counter, value in counters.items():
+                metrics.set_gauge('chat_webui_pool_' + counter.removeprefix('pool_'), value, {'client': client_name})
+    for counter, value in content_cache.get_stats().items():
+        metrics.set_gauge('chat_webui_cache_' + counter, value)
+    for gate in (stream_gate, retrieval_gate):
+        for counter, value in gate.get_stats().items():
+            metrics.set_gauge('chat_webui_admission_' + counter, value, {'gate': gate.name})
+    for stats in (provider_pool.get_stats() if provider_pool else []):
+        labels = {'provider': stats['name']}
+        metrics.set_gauge('chat_webui_provider_healthy', int(stats['healthy']), labels)
+        metrics.set_gauge('chat_webui_provider_outstanding', stats['outstanding'], labels)
+        if stats['latency'] is not None:
+            metrics.set_gauge('chat_webui_provider_latency_seconds', stats['latency'], labels)
+    if startup_seconds is not None:
+        metrics.set_gauge('chat_webui_startup_seconds', startup_seconds)
+    for name, seconds in list(module_import_seconds.items()):
+        metrics.set_gauge('chat_webui_module_import_seconds', seconds, {'module': name})
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Route to run several web searches and stream each page as newline-delimited JSON
+@app.route('/batch-search', methods=['POST'])
+def batch_search_route():
+    payload = request.get_json(silent=True)
+    queries = payload.get('queries') if isinstance(payload, dict) else None
+    if not isinstance(queries, list):
+        return jsonify({"error": "Please provide the search queries as a list"}), 400
+    queries = [query for query in queries if isinstance(query, str) and query.strip()]
+    if not queries:
+        return jsonify({"error": "Please provide at least one search query"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"A batch search takes at most {BATCH_MAX_QUERIES} queries"}), 400
+    try:
+        results = int(payload.get('results', DEFAULT_RESULTS))
+    except (TypeError, ValueError):
+        results = None
+    if results is None or not 1 <= results <= MAX_RESULTS:
+        return jsonify({"error": f"Results must be a number from 1 to {MAX_RESULTS}"}), 400
+    try:
+        ticket = admit_request(retrieval_gate)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    async def generate():
+        async for page in iter_batch_search(queries, results):
+            yield json.dumps(page) + '\n'
+
+    response = async_streaming_response(generate(), mimetype='application/x-ndjson')
+    response.call_on_close(ticket.release)
+    return response
+
+# Route to resume a Server-Sent Events stream after the last event the client received
+@app.route('/stream/<stream_id>', methods=['GET'])
+def resume_stream_route(stream_id):
+    stream_buffer = live_streams.get(stream_id)
+    if stream_buffer is None:
+        return jsonify({"error": "Stream not found"}), 404
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', request.args.get('lastEventId', 0)))
+    except ValueError:
+        last_event_id = 0
+    return async_streaming_response(iter_sse(stream_buffer, last_event_id), mimetype='text/event-stream', headers={'X-Stream-Id': stream_id, 'Cache-Control': 'no-cache'})
 
 # Route to handle saving settings
 @app.route('/save-settings', methods=['POST'])
 def save_settings_route():
-    global api_key, base_url, openai_client, preloaded_models
-    api_key = request.json.get('apiKey')
-    base_url = request.json.get('baseUrl')
-    openai_client = openai.OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-    )
-    save_settings(api_key, base_url)
-    preloaded_models = fetch_models()
+    save_settings(request.json.get('apiKey'), request.json.get('baseUrl'))
+    load_settings()
+    model_catalog.refresh()
     return jsonify({"status": "success"})
 
+# Function to tell whether a chat message is an @s command that retrieves sources
+def is_retrieval_command(user_content):
+    return isinstance(user_content, str) and user_content.lower().startswith("@s") and (len(user_content) == 2 or user_content[2].isspace())
+
+# Function to remove the whitespace-delimited token holding a match, such as a redirect URL around a nested link
+def remove_matched_token(text, match):
+    start, end = match.start(), match.end()
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    return ' '.join(part for part in (text[:start].strip(), text[end:].strip()) if part)
+
 # Route to handle chat requests
 @app.route('/chat', methods=['POST'])
 def chat():
     user_content = request.json.get('message')
     conversation_history = request.json.get('conversation', [])
+    conversation_id = request.json.get('conversationId')
     selected_model = request.json.get('model')
     system_content = request.json.get('systemContent', SYSTEM_CONTENT)
     parameters = request.json.get('parameters', {})
     is_deep_query_mode = request.json.get('isDeepQueryMode', False)
     start_tag = request.json.get('startTag', '<think>')
+    context_budget = request.json.get('contextBudget')
+    stream_format = request.json.get('streamFormat', 'text')
+    document_ids = request.json.get('documentIds') or []
+    # Sources are indexed per conversation, or under a scope the client names such as 'shared'
+    scope = request.json.get('retrievalScope') or conversation_id
+    original_message = user_content
+
+    # A budget the client sets must be a positive number of tokens
+    if context_budget is not None:
+        try:
+            context_budget = int(context_budget)
+        except (TypeError, ValueError):
+            context_budget = 0
+        if context_budget < 1:
+            return jsonify({"error": "contextBudget must be a positive number of tokens"}), 400
+
+    # Uploaded documents are referenced by ID and their text is added on the server
+    documents = [get_document_store().get(document_id) for document_id in document_ids]
+    missing = [document_id for document_id, document in zip(document_ids, documents) if document is None]
+    if missing:
+        return jsonify({"error": "Document not found", "documentIds": missing}), 404
+
+    # Load the history from the server-side store when the client uses one
+    if conversation_id:
+        try:
+            conversation_version, conversation_history = load_stored_conversation(conversation_id, conversation_history)
+        except ConversationVersionError as e:
+            return jsonify({"error": "Conversation version mismatch", "version": e.version}), 409
 
     # Convert string values to appropriate types for numeric parameters
     if parameters:
@@ -345,165 +3009,170 @@ def chat():
                 # Keep as is if not numeric
                 continue
 
-    additional_text = ""
-    # Only process search commands if user_content is a string (not an image message)
-    if isinstance(user_content, str):
-        if user_content.lower().startswith("@s") and (len(user_content) == 2 or user_content[2].isspace()):
-            user_content = user_content[2:].strip()
-
-            # Check for YouTube link
-            if re.search(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/.+', user_content):
-                additional_text = handle_youtube_command(user_content)
-                user_content = re.sub(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/[^ ]+', '', user_content).strip()
-                if user_content:
-                    system_content = "You are an assistant specialized in Question & Answer. Please provide a clear and concise response to the user query based on the video transcript. Query: {}".format(user_content)
-                    user_content = f"{user_content} \n\n "
-                else:
-                    system_content = "You are an assistant specialized in summarizing videos. Please provide a clear, concise, and well-formatted summary of the video content."
-
-            # Check for arXiv link
-            elif re.search(r'https?://arxiv\.org/(abs|pdf)/\d+\.\d+(v\d+)?', user_content):
-                additional_text = handle_arxiv_command(user_content)
-                if additional_text is None:
-                    return "Invalid arXiv URL"
-                # Extract any user query after the arXiv link
-                user_content = re.sub(r'https?://arxiv\.org/(abs|pdf)/\d+\.\d+(v\d+)?[^ ]*', '', user_content).strip()
-                if user_content:
-                    system_content = system_content = "You are an assistant specialized in Question & Answer. Please provide a clear and concise response to the user query based on the arXiv paper. Query: {}".format(user_content)
-                    user_content = f"{user_content} \n\n "
-                else:
-                    system_content = "You are an assistant specialized in summarizing arXiv papers. Please provide a clear, concise, and well-formatted summary of the paper's content."
-
-            # Check for general link
-            elif re.search(r'https?://[^\s]+', user_content):
-                additional_text = handle_webpage_command(user_content)
-                if additional_text is None:
-                    return "Please provide a valid URL"
-                user_content = re.sub(r'https?://[^\s]+[^ ]*', '', user_content).strip()
-                if user_content:
-                    system_content = "You are an assistant specialized in Question & Answer. Please provide a clear and concise response to the user query based on the webpage content. Query: {}".format(user_content)
-                    user_content = f"{user_content} \n\n "
+    # Retrieval commands also need a retrieval slot, which is given back once the sources are in
+    try:
+        ticket = admit_request(stream_gate, retrieval_gate) if is_retrieval_command(user_content) else admit_request(stream_gate)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    # Phase timings of this request, shared with the retrieval handlers
+    request_log = {'route': 'chat', 'command': None, 'phases': {}}
+    request_timings.set(request_log['phases'])
+    retrieval_scope.set(scope)
+
+    # Retrieval for @s commands runs at the start of the stream so progress can be reported
+    def build_messages(user_content, system_content):
+        additional_text = ""
+        # Only process search commands if user_content is a string (not an image message)
+        if isinstance(user_content, str):
+            if is_retrieval_command(user_content):
+                user_content = user_content[2:].strip()
+
+                with timed('command_detection'):
+                    route, match = command_router.classify(user_content)
+                request_log['command'] = route.name if route else 'search'
+
+                # Links are handled by the route registered for them
+                if route is not None:
+                    report_progress(route.stage, route.progress_message)
+                    additional_text = route.handler(user_content, match)
+                    if additional_text is None:
+                        return route.invalid_message
+                    user_content = remove_matched_token(user_content, match)
+                    if user_content:
+                        system_content = "You are an assistant specialized in Question & Answer. Please provide a clear and concise response to the user query based on the {}. Query: {}".format(route.subject, user_content)
+                        user_content = f"{user_content} \n\n "
+                    else:
+                        system_content = route.summary_prompt
+
+                # No link, treat as general search
                 else:
-                    system_content = "You are an assistant specialized in summarizing webpages. Please provide a clear, concise, and well-formatted summary of the webpage content."
+                    report_progress('searching', "Searching the web")
+                    additional_text = handle_search_command(user_content)
+                    user_content = f"SEARCH QUERY: {user_content} \n\n "
+                    system_content = f"""CURRENT_SYSTEM_TIME = f"{time.strftime("%Y-%m-%d %H:%M:%S")}" \n \n 
+                                    You are a knowledgeable search assistant. Analyze the following search query and use latest information from the provided source texts to create a comprehensive response: \n \n 
+
+                                    SEARCH QUERY: {user_content} \n \n 
+
+                                    Instructions:
+                                    - Focus ONLY on directly answering the query using the provided sources
+                                    - NO general background or context unless specifically requested
+                                    - Provide accurate, detailed information using an unbiased, journalistic tone
+                                    - Use markdown formatting for better readability:
+                                    • Lists and bullet points for multiple items
+                                    • Code blocks with language specification
+                                    • Tables for structured data
+                                    - Focus on factual information without subjective statements
+                                    - Organize information logically with clear paragraph breaks
+                                    - Match the query's language and tone
+
+                                    For specialized topics:
+                                    - Academic: Provide detailed analysis with proper sections
+                                    - News: Summarize key points with bullet points.
+                                    - Technical: Include code blocks with language specification
+                                    - Scientific: Use LaTeX for formulas (\\(inline\\) or \\[block\\])
+                                    - Biographical: Focus on key facts and achievements
+                                    - Products: Group options by category (max 5 recommendations)
+                                    """
+
+        # Follow-up questions get the chunks of earlier sources that best match them
+        if scope and request_log['command'] is None and isinstance(user_content, str):
+            index = get_retrieval_index()
+            if index.has_sources(scope):
+                with timed('retrieval'):
+                    chunks = index.search(scope, user_content)
+                request_log['retrieved_chunks'] = len(chunks)
+                additional_text += format_retrieved_chunks(chunks)
+
+        if documents:
+            with timed('document_loading'):
+                additional_text += format_documents(documents)
+
+        # Keep the injected source text within the token budget of the selected model
+        if additional_text:
+            report_progress('packing_context', "Selecting the most relevant passages")
+            with timed('context_packing'):
+                additional_text = pack_context(additional_text, user_content, selected_model, context_budget)
+        metrics.inc('chat_webui_requests_total', {'route': 'chat', 'command': request_log['command'] or 'none'})
 
-            # No link, treat as general search
-            else:
-                additional_text = handle_search_command(user_content)
-                user_content = f"SEARCH QUERY: {user_content} \n\n "
-                system_content = f"""CURRENT_SYSTEM_TIME = f"{time.strftime("%Y-%m-%d %H:%M:%S")}" \n \n 
-                                You are a knowledgeable search assistant. Analyze the following search query and use latest information from the provided source texts to create a comprehensive response: \n \n 
-
-                                SEARCH QUERY: {user_content} \n \n 
-
-                                Instructions:
-                                - Focus ONLY on directly answering the query using the provided sources
-                                - NO general background or context unless specifically requested
-                                - Provide accurate, detailed information using an unbiased, journalistic tone
-                                - Use markdown formatting for better readability:
-                                • Lists and bullet points for multiple items
-                                • Code blocks with language specification
-                                • Tables for structured data
-                                - Focus on factual information without subjective statements
-                                - Organize information logically with clear paragraph breaks
-                                - Match the query's language and tone
-
-                                For specialized topics:
-                                - Academic: Provide detailed analysis with proper sections
-                                - News: Summarize key points with bullet points.
-                                - Technical: Include code blocks with language specification
-                                - Scientific: Use LaTeX for formulas (\\(inline\\) or \\[block\\])
-                                - Biographical: Focus on key facts and achievements
-                                - Products: Group options by category (max 5 recommendations)
-                                """
-
-    # Handle messages with images
-    if isinstance(user_content, list):
-        # The message contains both text and image
         messages = [{"role": "system", "content": system_content}] if system_content else []
         messages.extend(conversation_history)
-        messages.append({"role": "user", "content": user_content})
-    else:
-        # Regular text message
-        if system_content:
-            messages = [{"role": "system", "content": system_content}] + conversation_history + [{"role": "user", "content": user_content + additional_text}]
+        if isinstance(user_content, list):
+            # The message contains both text and image
+            if additional_text:
+                user_content = user_content + [{"type": "text", "text": additional_text}]
+            messages.append({"role": "user", "content": user_content})
         else:
-            messages = conversation_history + [{"role": "user", "content": user_content + additional_text}]
+            # Regular text message, @s commands already end in a separator before their source text
+            separator = " \n\n " if additional_text and request_log['command'] is None else ""
+            messages.append({"role": "user", "content": user_content + separator + additional_text})
 
-    # Add deep query mode message if enabled
-    if is_deep_query_mode:
-        messages.append({"role": "assistant", "content": f"{start_tag}\n"})
+        # Add deep query mode message if enabled
+        if is_deep_query_mode:
+            messages.append({"role": "assistant", "content": f"{start_tag}\n"})
 
-    def generate():
-        if openai_client is None:
-            yield "Please set your API key and base URL in the settings."
-            return
+        return messages
 
+    def messages():
         try:
-            if parameters:
-                stream = openai_client.chat.completions.create(
-                    model=selected_model,
-                    messages=messages,
-                    stream=True,
-                    **parameters
-                )
-            else:
-                stream = openai_client.chat.completions.create(
-                    model=selected_model,
-                    messages=messages,
-                    stream=True
-                )
+            return build_messages(user_content, system_content)
+        finally:
+            ticket.release(retrieval_gate)
 
-            for chunk in stream:
-                if not chunk.choices or not chunk.choices[0].delta or chunk.choices[0].delta.content is None:
-                    continue
-                yield chunk.choices[0].delta.content
-        except Exception as e:
-            yield f"An error occurred: {str(e)}"
+    if not conversation_id:
+        return stream_chat_response(selected_model, messages, parameters, request_log=request_log, stream_format=stream_format, on_close=ticket.release)
+
+    # Store the exchange as the client sent it, without the injected source text
+    def on_complete(response_text):
+        save_stored_exchange(conversation_id, conversation_version, [
+            {"role": "user", "content": original_message},
+            {"role": "assistant", "content": response_text},
+        ])
 
-    return Response(generate(), mimetype='text/event-stream')
+    headers = {'X-Conversation-Version': str(conversation_version + 1)}
+    return stream_chat_response(selected_model, messages, parameters, on_complete, headers, request_log, stream_format, ticket.release)
 
 # Route to handle chat requests
 @app.route('/continue_generation', methods=['POST'])
 def continue_generation():
     conversation_history = request.json.get('conversation', [])
+    conversation_id = request.json.get('conversationId')
     selected_model = request.json.get('model', "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo")
     system_content = request.json.get('systemContent', SYSTEM_CONTENT)
     parameters = request.json.get('parameters', {})
+    stream_format = request.json.get('streamFormat', 'text')
+
+    # Load the history from the server-side store when the client uses one
+    if conversation_id:
+        try:
+            conversation_version, conversation_history = load_stored_conversation(conversation_id, conversation_history)
+        except ConversationVersionError as e:
+            return jsonify({"error": "Conversation version mismatch", "version": e.version}), 409
 
     if system_content == '':
         messages = conversation_history
     else:
         messages = [{"role": "system", "content": system_content}] + conversation_history
 
-    def generate():
-        if openai_client is None:
-            yield "Please set your API key and base URL in the settings."
-            return
+    try:
+        ticket = admit_request(stream_gate)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
 
-        try:
-            print(messages)
-            if parameters:
-                stream = openai_client.chat.completions.create(
-                    model=selected_model,
-                    messages=messages,
-                    stream=True,
-                    **parameters
-                )
-            else:
-                stream = openai_client.chat.completions.create(
-                    model=selected_model,
-                    messages=messages,
-                    stream=True
-                )
+    request_log = {'route': 'continue_generation', 'conversation_messages': len(conversation_history)}
+    metrics.inc('chat_webui_requests_total', {'route': 'continue_generation', 'command': 'none'})
+    if not conversation_id:
+        return stream_chat_response(selected_model, messages, parameters, request_log=request_log, stream_format=stream_format, on_close=ticket.release)
 
-            for chunk in stream:
-                if not chunk.choices or not chunk.choices[0].delta or chunk.choices[0].delta.content is None:
-                    continue
-                yield chunk.choices[0].delta.content
-        except Exception as e:
-            yield f"An error occurred: {str(e)}"
+    # Continued text is added to the last assistant message
+    def on_complete(response_text):
+        save_stored_exchange(conversation_id, conversation_version, [
+            {"role": "assistant", "content": response_text},
+        ], continue_last=True)
 
-    return Response(generate(), mimetype='text/event-stream')
+    headers = {'X-Conversation-Version': str(conversation_version + 1)}
+    return stream_chat_response(selected_model, messages, parameters, on_complete, headers, request_log, stream_format, ticket.release)
 
 # Route to generate a title for the conversation
 @app.route('/generate-title', methods=['POST'])
@@ -511,6 +3180,7 @@ def generate_title():
     message = request.json.get('message')
     selected_model = request.json.get('model')
     assistant_response = request.json.get('assistantResponse', '')
+    in_background = request.json.get('background', False)
     
     try:
         messages = [
@@ -527,23 +3197,238 @@ def generate_title():
                 "content": "The suitable title for this conversation is: "
             }
         ]
+
+        # In background mode the title is generated off the request path and fetched later by its ID
+        if in_background:
+            title_id = completion_cache_key(selected_model, messages, {'temperature': 0}).split(':', 1)[1]
+            cached = completion_cache.get(f"completion:{title_id}")
+            if cached is not None and cached[2]:
+                return jsonify({"title": cached[0].strip(), "titleId": title_id})
+            if title_id not in pending_titles:
+                future = asyncio.run_coroutine_threadsafe(generate_title_in_background(selected_model, messages), get_event_loop())
+                pending_titles[title_id] = future
+                future.add_done_callback(lambda done: finish_background_title(title_id, done))
+            return jsonify({"title": None, "titleId": title_id, "pending": True}), 202
         
-        response = openai_client.chat.completions.create(
-            model=selected_model,
-            messages=messages,
-            temperature=0
-        )
-        
-        title = response.choices[0].message.content.strip()
+        title = run_async(create_cached_completion(selected_model, messages, temperature=0)).strip()
         return jsonify({"title": title})
     except Exception as e:
         print(f"Error generating title: {e}")
         return jsonify({"title": None})
 
-# Load settings and preload models when the app starts
-print("Starting Chat WebUI")
-load_settings()
-preload_models()
+# Route to get a title generated in the background
+@app.route('/generate-title/<title_id>', methods=['GET'])
+def generated_title(title_id):
+    cached = completion_cache.get(f"completion:{title_id}")
+    if cached is not None:
+        return jsonify({"title": cached[0].strip(), "titleId": title_id})
+    if title_id in pending_titles:
+        return jsonify({"title": None, "titleId": title_id, "pending": True}), 202
+    return jsonify({"title": None, "titleId": title_id})
+
+# Thread pool that runs Flask views for asgi_app
+dispatch_executor = None
+dispatch_executor_lock = threading.Lock()
+
+# Function to get the view thread pool, starting it on first use
+def get_dispatch_executor():
+    global dispatch_executor
+    with dispatch_executor_lock:
+        if dispatch_executor is None:
+            dispatch_executor = ThreadPoolExecutor(max_workers=ASGI_DISPATCH_WORKERS, thread_name_prefix='dispatch')
+    return dispatch_executor
+
+# Function to build the WSGI environ of an ASGI HTTP request, body is a file positioned at its start
+def build_wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+# Function to run a Flask view for a WSGI environ and return its Response object
+def dispatch_request(environ):
+    context = app.request_context(environ)
+    error = None
+    context.push()
+    try:
+        try:
+            return app.full_dispatch_request()
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+    finally:
+        context.pop(error)
+
+# Function to send the body of a Flask response to an ASGI client
+async def send_response_body(response, send):
+    chunks = getattr(response, 'async_chunks', None)
+    if chunks is not None:
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk.encode() if isinstance(chunk, str) else chunk, 'more_body': True})
+        finally:
+            await chunks.aclose()
+    else:
+        # Regular bodies, such as JSON and static files, are read on the view threads
+        loop = asyncio.get_running_loop()
+        iterator = response.iter_encoded()
+        while (chunk := await loop.run_in_executor(get_dispatch_executor(), next, iterator, None)) is not None:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+# Function to receive the body of an ASGI request into a file that spills to disk
+async def receive_request_body(scope, receive):
+    """Return the body as a file positioned at its start, None when the client
+    disconnected, or raise OverflowError once it exceeds ASGI_MAX_BODY_BYTES."""
+    content_length = dict(scope['headers']).get(b'content-length', b'')
+    if content_length.isdigit() and int(content_length) > ASGI_MAX_BODY_BYTES:
+        raise OverflowError
+    body = tempfile.SpooledTemporaryFile(max_size=ASGI_BODY_SPOOL_BYTES)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > ASGI_MAX_BODY_BYTES:
+                raise OverflowError
+            body.write(chunk)
+            if not message.get('more_body'):
+                break
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body
+
+# Function to send a JSON error response to an ASGI client
+async def send_error_response(send, status, message):
+    payload = json.dumps({'error': message}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+# Function to wait until an ASGI client disconnects
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+# ASGI entry point, serve it with an ASGI server such as `uvicorn app:asgi_app`
+async def asgi_app(scope, receive, send):
+    """Serve the app from an ASGI server's event loop.
+
+    Views run on a thread pool as usual. Responses made by
+    async_streaming_response, such as chat streams, are then sent from the
+    event loop, so hundreds of open streams need no thread each. A client
+    that disconnects cancels its stream and the upstream request with it.
+    Request bodies are spooled to disk past ASGI_BODY_SPOOL_BYTES, and ones
+    over ASGI_MAX_BODY_BYTES are refused with a 413 as they arrive.
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if adopt_event_loop():
+                    await send({'type': 'lifespan.startup.complete'})
+                else:
+                    await send({'type': 'lifespan.startup.failed', 'message': "The background event loop is already running"})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    if not adopt_event_loop():
+        raise RuntimeError("asgi_app needs to run on the app's event loop, but the background event loop is already running")
+
+    try:
+        body = await receive_request_body(scope, receive)
+    except OverflowError:
+        await send_error_response(send, 413, f"Request bodies are limited to {ASGI_MAX_BODY_BYTES // (1024 * 1024)} MB")
+        return
+    if body is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        response = await loop.run_in_executor(get_dispatch_executor(), dispatch_request, build_wsgi_environ(scope, body))
+    finally:
+        # Views have read the request by the time they return
+        body.close()
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()],
+        })
+        sending = asyncio.ensure_future(send_response_body(response, send))
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            await asyncio.wait({sending, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnect.cancel()
+            sending.cancel()
+            await asyncio.gather(sending, disconnect, return_exceptions=True)
+        if not sending.cancelled():
+            sending.result()
+    finally:
+        # Runs the response's close callbacks, which give back its admission slots
+        response.close()
+
+# Function to report how long startup and each heavy import took
+def get_startup_report():
+    return {
+        'lazy_imports': LAZY_IMPORTS,
+        'startup_seconds': None if startup_seconds is None else round(startup_seconds, 4),
+        'models_preloaded': models_preloaded is None or models_preloaded.is_set(),
+        'imports': {name: round(seconds, 4) for name, seconds in module_import_seconds.items()},
+        'pending_imports': [module._name for module in (aiohttp, httpx, openai, fitz, docx, etree, html, youtube_transcript_api, requests) if module._module is None],
+    }
+
+# Route to tell a load balancer whether the app can take traffic
+@app.route('/ready', methods=['GET'])
+def ready_route():
+    report = get_startup_report()
+    # Until the first model list arrives, /models would make its callers wait
+    report['ready'] = report['models_preloaded']
+    return jsonify(report), 200 if report['ready'] else 503
+
+# Load settings and start preloading models in the background when the app starts,
+# but not when a process pool worker re-imports this file as its main script
+if __name__ != '__mp_main__':
+    print("Starting Chat WebUI")
+    load_settings()
+    models_preloaded = preload_models()
+    startup_seconds = time.perf_counter() - STARTUP_STARTED
+    print(f"Chat WebUI loaded in {startup_seconds:.3f}s, imports: " + (', '.join(f"{name} {seconds:.3f}s" for name, seconds in module_import_seconds.items()) or "deferred"))
 
 # Run the Flask app
 if __name__ == '__main__':
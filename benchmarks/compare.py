@@ -0,0 +1,62 @@
+"""Compare two benchmark result files and report regressions.
+
+    python benchmarks/compare.py before.json after.json --threshold 0.1
+
+Metrics ending in _ms are better when lower and metrics ending in
+_per_second are better when higher; other values are shown for context
+only. Exits with status 1 when any metric got worse by more than the
+threshold, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+# Function to tell whether a higher value of a metric is better, None when it is not a timing
+def higher_is_better(metric):
+    if metric.endswith('_per_second'):
+        return True
+    if metric.endswith('_ms'):
+        return False
+    return None
+
+# Function to compare the results of two runs, returns (rows, regressions)
+def compare(before, after, threshold):
+    rows = []
+    regressions = []
+    for benchmark, metrics in after['results'].items():
+        old_metrics = before['results'].get(benchmark, {})
+        for metric, value in metrics.items():
+            old_value = old_metrics.get(metric)
+            direction = higher_is_better(metric)
+            if direction is None or not isinstance(value, (int, float)) or not isinstance(old_value, (int, float)) or not old_value:
+                continue
+            change = (value - old_value) / old_value
+            is_regression = (-change if direction else change) > threshold
+            rows.append((benchmark, metric, old_value, value, change, is_regression))
+            if is_regression:
+                regressions.append(f"{benchmark}.{metric}")
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change that counts as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    rows, regressions = compare(before, after, args.threshold)
+    print(f"{before['environment'].get('commit')} -> {after['environment'].get('commit')}")
+    for benchmark, metric, old_value, value, change, is_regression in rows:
+        marker = '  REGRESSION' if is_regression else ''
+        print(f"{benchmark + '.' + metric:<45} {old_value:>12} {value:>12} {change:>+8.1%}{marker}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,579 @@
+"""Run the offline benchmark suite and print the results as JSON.
+
+The app is started on a local port with its upstreams pointed at the stub
+server in stubs.py, so no network access or API key is needed. Compare two
+result files with compare.py to catch regressions between commits.
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --only chat_ttfb,pdf_extraction --quick
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import logging
+import math
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from lxml import html
+from werkzeug.serving import make_server
+
+from stubs import StubServer, StubTranscriptApi, make_abstract_page, make_article_page, make_pdf, make_search_page
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Function to compute a percentile of a list of values
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+# Function to summarize durations given in seconds as milliseconds
+def summarize_ms(name, durations):
+    return {
+        f'{name}_p50_ms': round(percentile(durations, 50) * 1000, 3),
+        f'{name}_p95_ms': round(percentile(durations, 95) * 1000, 3),
+        f'{name}_mean_ms': round(statistics.fmean(durations) * 1000, 3),
+    }
+
+# Function to time a function over a number of iterations, returns seconds per call
+def time_calls(fn, iterations):
+    fn()  # warm up caches and lazy initialization
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+# Function to stream one chat request, returns (status, time to first byte, total time, bytes)
+def stream_chat(client, server_url, payload):
+    start = time.perf_counter()
+    first_byte_at = None
+    received = 0
+    with client.stream('POST', f"{server_url}/chat", json=payload) as response:
+        for chunk in response.iter_raw():
+            if chunk and first_byte_at is None:
+                first_byte_at = time.perf_counter()
+            received += len(chunk)
+    end = time.perf_counter()
+    return response.status_code, (first_byte_at or end) - start, end - start, received
+
+# Function to build a chat request body
+def chat_payload(message='Explain the benchmark', **fields):
+    return dict({'message': message, 'model': 'bench-model', 'conversation': [], 'parameters': {}}, **fields)
+
+# Benchmark of the time to first byte of sequential /chat streams
+def bench_chat_ttfb(ctx):
+    ttfbs = []
+    totals = []
+    with httpx.Client(timeout=60) as client:
+        stream_chat(client, ctx.server_url, chat_payload())
+        for _ in range(ctx.args.requests):
+            status, ttfb, total, _ = stream_chat(client, ctx.server_url, chat_payload())
+            if status != 200:
+                raise RuntimeError(f"/chat answered {status}")
+            ttfbs.append(ttfb)
+            totals.append(total)
+    return dict(requests=ctx.args.requests, **summarize_ms('ttfb', ttfbs), **summarize_ms('total', totals))
+
+# Benchmark of /chat throughput with N streams running at once
+def bench_chat_concurrency(ctx):
+    concurrency = ctx.args.concurrency
+    total_requests = concurrency * ctx.args.rounds
+    # Every stream comes from the same address, so the per-client cap is lifted for the run
+    ctx.app.stream_gate.client_limit = max(ctx.app.stream_gate.client_limit, concurrency)
+    ctx.app.stream_gate.limit = max(ctx.app.stream_gate.limit, concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    with httpx.Client(timeout=120, limits=limits) as client, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda _: stream_chat(client, ctx.server_url, chat_payload()), range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result[0] == 200]
+    return dict(
+        concurrency=concurrency,
+        requests=total_requests,
+        errors=total_requests - len(succeeded),
+        streams_per_second=round(len(succeeded) / elapsed, 3),
+        bytes_per_second=round(sum(result[3] for result in succeeded) / elapsed, 1),
+        **summarize_ms('ttfb', [result[1] for result in succeeded]),
+        **summarize_ms('total', [result[2] for result in succeeded]),
+    )
+
+# Script that serves the app in its own process, with the admission and pool caps raised for the load test
+SERVER_SCRIPT = """
+import logging, sys
+import app
+mode, port, concurrency = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+app.logger.setLevel(logging.WARNING)
+app.POOL_MAX_CONNECTIONS = max(app.POOL_MAX_CONNECTIONS, concurrency)
+app.POOL_MAX_KEEPALIVE_CONNECTIONS = max(app.POOL_MAX_KEEPALIVE_CONNECTIONS, concurrency)
+app.stream_gate.limit = app.stream_gate.client_limit = concurrency
+if mode == 'asgi':
+    import uvicorn
+    uvicorn.run(app.asgi_app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+else:
+    from werkzeug.serving import make_server
+    make_server('127.0.0.1', port, app.app, threaded=True).serve_forever()
+"""
+
+# Function to find a free local port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Function to read the number of threads of a process, None where /proc is not available
+def thread_count(pid):
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+# Function to run many /chat streams at once from one event loop, returns (results, seconds)
+async def stream_chats_at_once(server_url, concurrency, total_requests):
+    # aiohttp rather than httpx, whose connection pool costs more CPU than the server under test at this scale
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+        async def stream_one():
+            start = time.perf_counter()
+            first_byte_at = None
+            received = 0
+            try:
+                async with session.post(f"{server_url}/chat", json=chat_payload()) as response:
+                    async for chunk in response.content.iter_any():
+                        if chunk and first_byte_at is None:
+                            first_byte_at = time.perf_counter()
+                        received += len(chunk)
+                status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+            end = time.perf_counter()
+            return status, (first_byte_at or end) - start, end - start, received
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(stream_one() for _ in range(total_requests)))
+        return results, time.perf_counter() - start
+
+# Benchmark of hundreds of /chat streams at once, served by the WSGI server and by asgi_app
+def bench_serving_modes(ctx):
+    concurrency = ctx.args.stream_concurrency
+    total_requests = concurrency * ctx.args.rounds
+    if not importlib.util.find_spec('aiohttp'):
+        return {'error': "aiohttp is not installed"}
+    results = {'concurrency': concurrency, 'requests': total_requests}
+    modes = ['wsgi'] + (['asgi'] if importlib.util.find_spec('uvicorn') else [])
+    if len(modes) == 1:
+        results['asgi_error'] = "uvicorn is not installed"
+    # Streams of a few seconds at a model-like token rate, so most of the run has every stream open at once
+    token_delay, ctx.stub.token_delay = ctx.stub.token_delay, ctx.args.stream_token_delay
+    try:
+        for mode in modes:
+            results.update(load_test_server(ctx, mode, concurrency, total_requests))
+    finally:
+        ctx.stub.token_delay = token_delay
+    return results
+
+# Function to load test one server process with many /chat streams at once
+def load_test_server(ctx, mode, concurrency, total_requests):
+    port = free_port()
+    server_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    server = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, mode, str(port), str(concurrency)], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # The server is ready once it has loaded the model list from the stub
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"{server_url}/ready", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline or server.poll() is not None:
+                raise RuntimeError(f"The {mode} server did not start")
+            time.sleep(0.1)
+        # One stream first, so the lazy imports and upstream clients are in place
+        with httpx.Client(timeout=60) as client:
+            stream_chat(client, server_url, chat_payload())
+
+        peak_threads = [thread_count(server.pid)]
+        sampling = threading.Event()
+        def sample():
+            while not sampling.wait(0.05):
+                peak_threads.append(thread_count(server.pid))
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            results, elapsed = asyncio.run(stream_chats_at_once(server_url, concurrency, total_requests))
+        finally:
+            sampling.set()
+            sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    succeeded = [result for result in results if result[0] == 200]
+    summary = {
+        f'{mode}_errors': total_requests - len(succeeded),
+        f'{mode}_streams_per_second': round(len(succeeded) / elapsed, 3),
+        f'{mode}_peak_threads': None if None in peak_threads else max(peak_threads),
+    }
+    if succeeded:
+        summary.update(summarize_ms(f'{mode}_ttfb', [result[1] for result in succeeded]))
+        summary.update(summarize_ms(f'{mode}_total', [result[2] for result in succeeded]))
+    return summary
+
+# Benchmark of /chat with an @s web search against the fake DuckDuckGo Lite page
+def bench_chat_search(ctx):
+    ttfbs = []
+    totals = []
+    with httpx.Client(timeout=60) as client:
+        for index in range(ctx.args.requests):
+            # A new query each time so the search and its pages are not served from the cache
+            payload = chat_payload(f"@s benchmark query {uuid.uuid4().hex[:8]} {index}")
+            status, ttfb, total, _ = stream_chat(client, ctx.server_url, payload)
+            if status != 200:
+                raise RuntimeError(f"/chat answered {status}")
+            ttfbs.append(ttfb)
+            totals.append(total)
+    return dict(requests=ctx.args.requests, **summarize_ms('ttfb', ttfbs), **summarize_ms('total', totals))
+
+# Benchmark of parse_results on a DuckDuckGo Lite page
+def bench_parse_results(ctx):
+    page = make_search_page('parse results', ctx.stub.base_url)
+    seconds = time_calls(lambda: ctx.app.parse_results(page, 10), ctx.args.iterations * 10)
+    return {'page_bytes': len(page), 'parses_per_second': round(1 / seconds, 1), 'parse_ms': round(seconds * 1000, 4)}
+
+# Benchmark of the streaming text extractor against a full tree parse of the same page
+def bench_text_extraction(ctx):
+    page = make_article_page('extraction', ctx.args.page_paragraphs).encode()
+    chunk_size = ctx.app.STREAM_CHUNK_SIZE
+    chunks = [page[start:start + chunk_size] for start in range(0, len(page), chunk_size)]
+    max_bytes, max_chars = ctx.app.MAX_PAGE_BYTES, ctx.app.MAX_PAGE_CHARS
+
+    # The XPath extraction the app used before the streaming parser, on the whole page
+    def xpath_extract(content):
+        tree = html.fromstring(content)
+        return ' '.join(
+            node.strip() for node in tree.xpath('//text()[not(ancestor::style) and not(ancestor::script) and normalize-space()]')
+        )
+
+    def streaming_extract(max_bytes, max_chars):
+        text_stream = ctx.app.HTMLTextStream(max_bytes, max_chars, 'utf-8')
+        for chunk in chunks:
+            if not text_stream.feed(chunk):
+                break
+        return text_stream.close()
+
+    # Both sides with the page budgets, the XPath side given the first MAX_PAGE_BYTES of the page
+    streaming = time_calls(lambda: streaming_extract(max_bytes, max_chars), ctx.args.iterations)
+    xpath = time_calls(lambda: xpath_extract(page[:max_bytes])[:max_chars], ctx.args.iterations)
+    # Both sides over the whole page, which is the cost of the extraction itself
+    streaming_unbounded = time_calls(lambda: streaming_extract(math.inf, sys.maxsize), ctx.args.iterations)
+    xpath_unbounded = time_calls(lambda: xpath_extract(page), ctx.args.iterations)
+    same_text = streaming_extract(math.inf, sys.maxsize) == xpath_extract(page)
+    megabytes = len(page) / 1e6
+    return {
+        'page_bytes': len(page),
+        'max_page_bytes': max_bytes,
+        'max_page_chars': max_chars,
+        'same_text': same_text,
+        'streaming_ms': round(streaming * 1000, 3),
+        'xpath_ms': round(xpath * 1000, 3),
+        'streaming_unbounded_ms': round(streaming_unbounded * 1000, 3),
+        'xpath_unbounded_ms': round(xpath_unbounded * 1000, 3),
+        'streaming_unbounded_mb_per_second': round(megabytes / streaming_unbounded, 2),
+        'xpath_unbounded_mb_per_second': round(megabytes / xpath_unbounded, 2),
+    }
+
+# Benchmark of PDF text extraction in this process and in the process pool
+def bench_pdf_extraction(ctx):
+    pdf_bytes = make_pdf(ctx.args.pdf_pages)
+    parallel_min_pages = ctx.app.PDF_PARALLEL_MIN_PAGES
+    try:
+        ctx.app.PDF_PARALLEL_MIN_PAGES = math.inf
+        serial = time_calls(lambda: ctx.app.extract_pdf_text(pdf_bytes), ctx.args.pdf_iterations)
+        ctx.app.PDF_PARALLEL_MIN_PAGES = 1
+        parallel = time_calls(lambda: ctx.app.extract_pdf_text(pdf_bytes), ctx.args.pdf_iterations)
+    finally:
+        ctx.app.PDF_PARALLEL_MIN_PAGES = parallel_min_pages
+    return {
+        'pages': ctx.args.pdf_pages,
+        'workers': ctx.app.PDF_WORKERS,
+        'serial_ms': round(serial * 1000, 3),
+        'parallel_ms': round(parallel * 1000, 3),
+        'serial_pages_per_second': round(ctx.args.pdf_pages / serial, 1),
+        'parallel_pages_per_second': round(ctx.args.pdf_pages / parallel, 1),
+    }
+
+# Benchmark of the arXiv handler on stub abstract pages and PDFs
+def bench_arxiv(ctx):
+    pdf_durations = []
+    abstract_durations = []
+    for index in range(ctx.args.pdf_iterations):
+        paper_id = f"2401.{10000 + index}v{uuid.uuid4().int % 1000 + 1}"
+        start = time.perf_counter()
+        ctx.app.handle_arxiv_command(f"https://arxiv.org/pdf/{paper_id}")
+        pdf_durations.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        ctx.app.handle_arxiv_command(f"https://arxiv.org/abs/{paper_id}")
+        abstract_durations.append(time.perf_counter() - start)
+    return dict(pages=ctx.args.pdf_pages, **summarize_ms('pdf', pdf_durations), **summarize_ms('abstract', abstract_durations))
+
+# Benchmark of the YouTube handler on stub transcripts
+def bench_youtube(ctx):
+    durations = []
+    for _ in range(ctx.args.iterations):
+        video_id = uuid.uuid4().hex[:11]
+        start = time.perf_counter()
+        ctx.app.handle_youtube_command(f"https://www.youtube.com/watch?v={video_id}")
+        durations.append(time.perf_counter() - start)
+    return dict(transcripts=len(durations), **summarize_ms('transcript', durations))
+
+# Benchmark of identical fetches made at the same time, which should share one download
+def bench_coalescing(ctx):
+    concurrency = ctx.args.concurrency
+    name = uuid.uuid4().hex
+    url = f"{ctx.stub.base_url}/slow/{name}"
+    barrier = threading.Barrier(concurrency)
+
+    def fetch(_):
+        barrier.wait()
+        return ctx.app.handle_webpage_command(url)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        texts = list(executor.map(fetch, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    downloads = ctx.stub.hits[f"slow:{name}"]
+    if downloads != 1:
+        raise AssertionError(f"{concurrency} identical fetches made {downloads} downloads")
+    return {
+        'requests': concurrency,
+        'downloads': downloads,
+        'identical_results': len(set(texts)) == 1,
+        'wall_ms': round(elapsed * 1000, 3),
+    }
+
+# Messages for the command routing benchmark, one for each kind of @s command
+ROUTING_MESSAGES = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ what is the song about",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "https://arxiv.org/abs/2401.12345v2 what is the main contribution of this paper",
+    "https://arxiv.org/pdf/2401.12345",
+    "summarize https://example.com/blog/2024/01/a-long-article-about-streaming-servers",
+    "what are the best practices for connection pooling in python web servers " * 3,
+]
+
+# Function to classify a message the way chat() did before the command router, kept for comparison
+def legacy_route(user_content):
+    if re.search(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/.+', user_content):
+        for pattern in (r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([a-zA-Z0-9_-]{11})', r'^[a-zA-Z0-9_-]{11}$'):
+            if re.search(pattern, user_content):
+                break
+        return 'youtube', re.sub(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/[^ ]+', '', user_content).strip()
+    if re.search(r'https?://arxiv\.org/(abs|pdf)/\d+\.\d+(v\d+)?', user_content):
+        re.search(r'https?://arxiv\.org/(abs|pdf)/(\d+\.\d+)(v\d+)?', user_content)
+        return 'arxiv', re.sub(r'https?://arxiv\.org/(abs|pdf)/\d+\.\d+(v\d+)?[^ ]*', '', user_content).strip()
+    if re.search(r'https?://[^\s]+', user_content):
+        re.search(r'https?://[^\s]+', user_content)
+        return 'webpage', re.sub(r'https?://[^\s]+[^ ]*', '', user_content).strip()
+    return 'search', user_content
+
+# Benchmark of classifying @s commands with the command router against the old regex chain
+def bench_command_routing(ctx):
+    router = ctx.app.command_router
+
+    def route_all():
+        for message in ROUTING_MESSAGES:
+            route, match = router.classify(message)
+            if match is not None:
+                (message[:match.start()] + message[match.end():]).strip()
+
+    def legacy_route_all():
+        for message in ROUTING_MESSAGES:
+            legacy_route(message)
+
+    iterations = ctx.args.iterations * 500
+    router_seconds = time_calls(route_all, iterations) / len(ROUTING_MESSAGES)
+    legacy_seconds = time_calls(legacy_route_all, iterations) / len(ROUTING_MESSAGES)
+    return {
+        'messages': len(ROUTING_MESSAGES),
+        'router_messages_per_second': round(1 / router_seconds),
+        'legacy_messages_per_second': round(1 / legacy_seconds),
+    }
+
+# Benchmark of the writes and bytes each stream format needs for one completion
+def bench_stream_writes(ctx):
+    client = ctx.app.app.test_client()
+    results = {}
+    for stream_format in ('text', 'ndjson', 'sse'):
+        response = client.post('/chat', json=chat_payload(streamFormat=stream_format), buffered=False)
+        writes = 0
+        sent = 0
+        for chunk in response.response:
+            writes += 1
+            sent += len(chunk)
+        response.close()
+        results[f'{stream_format}_writes'] = writes
+        results[f'{stream_format}_bytes'] = sent
+    results['upstream_tokens'] = ctx.stub.tokens
+    return results
+
+# Benchmark of starting a fresh app process, with heavy imports deferred and with them loaded at startup
+def bench_startup(ctx):
+    script = "import json, time; start = time.perf_counter(); import app; print(json.dumps(dict(app.get_startup_report(), import_seconds=time.perf_counter() - start)))"
+    results = {}
+    for mode, eager in (('lazy', '0'), ('eager', '1')):
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, CHAT_WEBUI_EAGER_IMPORTS=eager)
+        cold_starts = []
+        imports = []
+        for _ in range(ctx.args.startup_runs):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+            cold_starts.append(time.perf_counter() - start)
+            report = json.loads(completed.stdout.strip().splitlines()[-1])
+            imports.append(report['import_seconds'])
+        results.update(summarize_ms(f'{mode}_cold_start', cold_starts))
+        results.update(summarize_ms(f'{mode}_import', imports))
+        if eager == '1':
+            results['module_import_ms'] = {name: round(seconds * 1000, 3) for name, seconds in report['imports'].items()}
+    return results
+
+BENCHMARKS = {
+    'chat_ttfb': bench_chat_ttfb,
+    'chat_concurrency': bench_chat_concurrency,
+    'serving_modes': bench_serving_modes,
+    'chat_search': bench_chat_search,
+    'parse_results': bench_parse_results,
+    'text_extraction': bench_text_extraction,
+    'pdf_extraction': bench_pdf_extraction,
+    'arxiv': bench_arxiv,
+    'youtube': bench_youtube,
+    'coalescing': bench_coalescing,
+    'command_routing': bench_command_routing,
+    'stream_writes': bench_stream_writes,
+    'startup': bench_startup,
+}
+
+# Function to import the app with its settings, caches and upstreams pointed at the stubs
+def load_app(stub, work_dir, pdf_pages):
+    with open(os.path.join(work_dir, 'settings.json'), 'w') as file:
+        json.dump({'api_key': 'benchmark', 'base_url': f"{stub.base_url}/v1"}, file)
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    app.logger.setLevel(logging.WARNING)
+    app.SEARCH_URL = f"{stub.base_url}/lite/"
+    app.list_video_transcripts = lambda video_id, session: StubTranscriptApi.list_transcripts(video_id)
+
+    # arxiv.org links are answered by a stub transport on the app's shared client
+    pdf_bytes = make_pdf(pdf_pages)
+
+    def arxiv_handler(request):
+        paper_id = request.url.path.rsplit('/', 1)[-1]
+        if request.url.path.startswith('/pdf/'):
+            return httpx.Response(200, content=pdf_bytes, headers={'Content-Type': 'application/pdf'})
+        return httpx.Response(200, text=make_abstract_page(paper_id), headers={'Content-Type': 'text/html'})
+
+    app.http_client = httpx.Client(
+        mounts={'all://arxiv.org': httpx.MockTransport(arxiv_handler)},
+        event_hooks={'request': [app.on_httpx_request]},
+        **app.httpx_client_options()
+    )
+    return app
+
+# Function to describe the environment the results were measured in
+def get_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+# Function to parse the command line
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help="comma-separated benchmarks to run: " + ', '.join(BENCHMARKS))
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--quick', action='store_true', help="fewer iterations, for a fast smoke run")
+    parser.add_argument('--requests', type=int, default=30, help="sequential /chat requests")
+    parser.add_argument('--concurrency', type=int, default=16, help="streams or fetches running at once")
+    parser.add_argument('--rounds', type=int, default=4, help="requests per concurrent stream slot")
+    parser.add_argument('--stream-concurrency', type=int, default=256, help="streams at once in the serving_modes load test")
+    parser.add_argument('--stream-token-delay', type=float, default=0.05, help="seconds between mock completion tokens in the serving_modes load test")
+    parser.add_argument('--iterations', type=int, default=20, help="iterations of the parsing benchmarks")
+    parser.add_argument('--page-paragraphs', type=int, default=2000, help="paragraphs in the extraction test page")
+    parser.add_argument('--pdf-pages', type=int, default=64, help="pages in the test PDF")
+    parser.add_argument('--pdf-iterations', type=int, default=3, help="iterations of the PDF benchmarks")
+    parser.add_argument('--tokens', type=int, default=64, help="tokens in each mock completion")
+    parser.add_argument('--token-delay', type=float, default=0.005, help="seconds between mock completion tokens")
+    parser.add_argument('--startup-runs', type=int, default=5, help="fresh app processes started per import mode")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.requests, args.rounds, args.iterations, args.pdf_iterations, args.startup_runs = 5, 1, 3, 1, 2
+        args.concurrency = min(args.concurrency, 8)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    stub = StubServer(tokens=args.tokens, token_delay=args.token_delay)
+    stub.start()
+    output_path = os.path.abspath(args.output) if args.output else None
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(sys.stderr):
+        app = load_app(stub, work_dir, args.pdf_pages)
+        server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+        ctx = argparse.Namespace(app=app, stub=stub, args=args, server_url=f"http://127.0.0.1:{server.server_port}")
+        for name in names:
+            print(f"Running {name}...")
+            start = time.perf_counter()
+            try:
+                results[name] = BENCHMARKS[name](ctx)
+            except Exception as e:
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+            print(f"{name} took {time.perf_counter() - start:.1f}s")
+        server.shutdown()
+        os.chdir(REPO_DIR)
+    stub.stop()
+
+    report = {'environment': get_environment(), 'settings': vars(args), 'results': results}
+    text = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
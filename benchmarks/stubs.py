@@ -0,0 +1,256 @@
+"""Local stand-ins for the services the app talks to, so the benchmarks run offline.
+
+Everything here is generated from fixed seeds, so two runs on the same
+machine see exactly the same pages, PDFs, transcripts and token streams.
+"""
+import asyncio
+import json
+import random
+import threading
+from collections import Counter
+
+import fitz
+from aiohttp import web
+from youtube_transcript_api import NoTranscriptFound
+
+WORDS = (
+    "model context stream token latency server request response search page "
+    "paper transcript video result source network cache parser extraction "
+    "throughput benchmark python thread socket buffer chunk document summary "
+    "query answer retrieval index language system design memory process"
+).split()
+
+# Function to build deterministic filler text
+def make_text(word_count, seed):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(word_count))
+
+# Function to build a DuckDuckGo Lite results page linking to the stub pages
+def make_search_page(query, base_url, results=30):
+    rows = []
+    for index in range(results):
+        # Lite pages mix ads and navigation links to duckduckgo.com in with the results
+        if index % 5 == 0:
+            rows.append(f'<tr><td><a href="https://duckduckgo.com/y.js?ad={index}">Sponsored</a></td></tr>')
+        slug = f"{query.replace(' ', '-')}-{index}"
+        rows.append(
+            f'<tr><td>{index + 1}.&nbsp;</td><td><a rel="nofollow" href="{base_url}/pages/{slug}?paragraphs=40" class="result-link">{slug}</a></td></tr>'
+            f'<tr><td>&nbsp;</td><td class="result-snippet">{make_text(30, slug)}</td></tr>'
+            f'<tr><td>&nbsp;</td><td><span class="link-text">{base_url}/pages/{slug}</span></td></tr>'
+        )
+    return (
+        '<html><head><title>DuckDuckGo</title><style>td { padding: 2px }</style></head><body>'
+        '<form action="/lite/" method="post"><input name="q" type="text"></form>'
+        f'<table border="0">{"".join(rows)}</table>'
+        '<a href="https://duckduckgo.com/lite/?q=next">Next Page</a></body></html>'
+    )
+
+# Function to build an article page with navigation, scripts and styles around the text
+def make_article_page(name, paragraphs=2000):
+    rng = random.Random(name)
+    blocks = []
+    for index in range(paragraphs):
+        if index % 25 == 0:
+            blocks.append(f'<h2>Section {index // 25 + 1}</h2>')
+        if index % 40 == 0:
+            blocks.append(f'<script>window.track({index}, "{make_text(20, rng.random())}");</script>')
+        if index % 60 == 0:
+            blocks.append(f'<style>.block-{index} {{ margin: {index % 7}px }}</style><!-- ad slot {index} -->')
+        blocks.append(f'<p>{make_text(rng.randint(40, 120), rng.random())} <a href="/pages/{index}">link</a> <b>{make_text(3, index)}</b></p>')
+    navigation = ''.join(f'<li><a href="/section/{index}">Section {index}</a></li>' for index in range(50))
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{name}</title>'
+        '<script>var config = {"analytics": true};</script><style>body { font-family: sans-serif }</style></head>'
+        f'<body><nav><ul>{navigation}</ul></nav><article>{"".join(blocks)}</article>'
+        '<footer><p>Footer text</p></footer></body></html>'
+    )
+
+# Function to build a paper-like PDF with one block of text per page
+def make_pdf(pages=64, seed='paper'):
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        text = make_text(450, f"{seed}-{page_number}")
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=9)
+    pdf_bytes = document.tobytes()
+    document.close()
+    return pdf_bytes
+
+# Function to build an arXiv abstract page in the layout the app parses
+def make_abstract_page(paper_id):
+    return (
+        f'<html><body><h1 class="title">Paper {paper_id}</h1>'
+        f'<blockquote class="abstract"><span class="descriptor">Abstract:</span>{make_text(250, paper_id)}</blockquote>'
+        '<td class="tablecell label">Comments:</td><td>12 pages</td></body></html>'
+    )
+
+# Stand-ins for the parts of youtube_transcript_api the app uses
+class StubTranscript:
+    def __init__(self, video_id, language_code, segments=600):
+        self.video_id = video_id
+        self.language_code = language_code
+        self.segments = segments
+
+    def fetch(self):
+        rng = random.Random(f"{self.video_id}-{self.language_code}")
+        return [
+            {'text': make_text(rng.randint(6, 14), rng.random()), 'start': index * 3.2, 'duration': 3.2}
+            for index in range(self.segments)
+        ]
+
+class StubTranscriptList:
+    def __init__(self, video_id, languages=('de', 'en', 'fr')):
+        self.video_id = video_id
+        self.transcripts = {language: StubTranscript(video_id, language) for language in languages}
+
+    def __iter__(self):
+        return iter(self.transcripts.values())
+
+    def find_transcript(self, language_codes):
+        for language_code in language_codes:
+            if language_code in self.transcripts:
+                return self.transcripts[language_code]
+        raise NoTranscriptFound(self.video_id, language_codes, self.transcripts)
+
+class StubTranscriptApi:
+    @staticmethod
+    def list_transcripts(video_id):
+        return StubTranscriptList(video_id)
+
+# Local server for the mock OpenAI API, DuckDuckGo Lite and web pages
+class StubServer:
+    """Serve every upstream the benchmarks need on one local port.
+
+    Completions stream `tokens` chunks spaced `token_delay` seconds apart.
+    /slow/<name> answers after `page_delay` seconds and counts its hits, so
+    tests of coalesced fetches can see how many downloads were made.
+    /trickle/<name> sends its headers at once and its body over `page_delay`
+    seconds, and records the most bodies it was sending at the same time.
+
+    Two more OpenAI base URLs fail on purpose, for tests of provider failover:
+    /status/<code>/v1 answers every completion with that HTTP status, and
+    /truncated/v1 drops the connection after the first two tokens.
+    """
+
+    def __init__(self, tokens=64, token_delay=0.005, page_delay=0.2):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.page_delay = page_delay
+        self.hits = Counter()
+        self.open_bodies = 0
+        self.peak_open_bodies = 0
+        self.base_url = None
+        self.loop = None
+        self.runner = None
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.serve())
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name='stub-server', daemon=True).start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def serve(self):
+        app = web.Application()
+        app.router.add_get('/v1/models', self.models)
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        app.router.add_post('/status/{code}/v1/chat/completions', self.failing_completions)
+        app.router.add_post('/truncated/v1/chat/completions', self.truncated_completions)
+        app.router.add_post('/lite/', self.search)
+        app.router.add_get('/pages/{name}', self.page)
+        app.router.add_get('/slow/{name}', self.slow_page)
+        app.router.add_get('/trickle/{name}', self.trickle_page)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def models(self, request):
+        return web.json_response({'object': 'list', 'data': [{'id': 'bench-model', 'object': 'model'}]})
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.hits['chat'] += 1
+        if not body.get('stream'):
+            return web.json_response({
+                'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'Benchmark Title'}}],
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        words = make_text(self.tokens, 'completion').split()
+        for word in words:
+            chunk = {
+                'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def failing_completions(self, request):
+        code = int(request.match_info['code'])
+        self.hits[f"status:{code}"] += 1
+        return web.json_response({'error': {'message': f"Stub failure {code}", 'type': 'stub_error'}}, status=code)
+
+    async def truncated_completions(self, request):
+        body = await request.json()
+        self.hits['truncated'] += 1
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for word in make_text(2, 'truncated').split():
+            chunk = {
+                'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await asyncio.sleep(0.05)
+        request.transport.close()
+        return response
+
+    async def search(self, request):
+        data = await request.post()
+        self.hits['search'] += 1
+        return web.Response(text=make_search_page(data.get('q', ''), self.base_url), content_type='text/html')
+
+    async def page(self, request):
+        paragraphs = int(request.query.get('paragraphs', 2000))
+        self.hits['page'] += 1
+        return web.Response(text=make_article_page(request.match_info['name'], paragraphs), content_type='text/html')
+
+    async def slow_page(self, request):
+        self.hits[f"slow:{request.match_info['name']}"] += 1
+        await asyncio.sleep(self.page_delay)
+        return web.Response(text=make_article_page(request.match_info['name'], 20), content_type='text/html')
+
+    async def trickle_page(self, request):
+        self.hits[f"trickle:{request.match_info['name']}"] += 1
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+        await response.prepare(request)
+        self.open_bodies += 1
+        self.peak_open_bodies = max(self.peak_open_bodies, self.open_bodies)
+        try:
+            body = make_article_page(request.match_info['name'], 4).encode()
+            step = len(body) // 4 + 1
+            for start in range(0, len(body), step):
+                await response.write(body[start:start + step])
+                await asyncio.sleep(self.page_delay / 4)
+        finally:
+            self.open_bodies -= 1
+        await response.write_eof()
+        return response
@@ -0,0 +1,77 @@
+"""Text extraction for PDF pages and uploaded documents.
+
+The functions here run in the worker processes of the app's extraction
+pool. This module has no import-time side effects and does not import the
+app, so a worker does not load the settings, preload models or start
+threads. The parsers are imported inside the functions, so the app can
+import this module at startup without loading them.
+"""
+
+# lxml parser target that collects visible text without building a tree
+class TextExtractor:
+    SKIPPED_TAGS = ('script', 'style')
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.parts = []
+        self.pending = []
+        self.chars = 0
+        self.skip_depth = 0
+
+    @property
+    def is_full(self):
+        return self.chars >= self.max_chars
+
+    def start(self, tag, attrib):
+        self.flush()
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth += 1
+
+    def end(self, tag):
+        self.flush()
+        if tag in self.SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def comment(self, text):
+        self.flush()
+
+    def data(self, data):
+        if not self.skip_depth and not self.is_full:
+            self.pending.append(data)
+
+    def flush(self):
+        # A text node may arrive in several data() calls, so it is only stripped once complete
+        text = ''.join(self.pending).strip()
+        self.pending.clear()
+        if text and not self.is_full:
+            self.parts.append(text)
+            self.chars += len(text) + 1
+
+    def close(self):
+        self.flush()
+        return ' '.join(self.parts)[:self.max_chars]
+
+# Function to extract the text of a range of pages of a PDF file on disk
+def extract_pdf_pages(path, start, stop):
+    import fitz
+    with fitz.open(path) as pdf_document:
+        return [pdf_document[page_number].get_text() for page_number in range(start, stop)]
+
+# Function to extract the text of a DOCX, HTML or text file on disk
+def extract_document_text(path, kind, max_chars):
+    if kind == 'docx':
+        import docx
+        document = docx.Document(path)
+        parts = [paragraph.text for paragraph in document.paragraphs]
+        for table in document.tables:
+            for row in table.rows:
+                parts.append(' | '.join(cell.text for cell in row.cells))
+        return '\n'.join(part for part in parts if part)
+    with open(path, 'rb') as file:
+        data = file.read()
+    if kind == 'html':
+        from lxml import etree
+        parser = etree.HTMLParser(target=TextExtractor(max_chars))
+        parser.feed(data)
+        return parser.close()
+    return data.decode('utf-8-sig', errors='replace')
@@ -56,6 +56,7 @@ let selectedModel = '';
 let newConversationStarted = false;
 let conversations = {};
 let currentConversationId = null;
+let serverConversations = {}; // conversation ID -> version the server holds and the history it was given
 let currentController = null;
 let isPrivateChat = false;
 let hasImageAttached = false;
@@ -96,6 +97,47 @@ function checkForEndTag(content) {
     return DEFAULT_END_TAG.some(tag => content.includes(tag)) || content.includes(END_TAG);
 }
 
+// Function to create a reader for ndjson chat streams, returns the text of each chunk and passes progress events to onProgress
+function createStreamEventParser(onProgress) {
+    const decoder = new TextDecoder();
+    let buffered = '';
+    return function (value) {
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        let text = '';
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.type === 'delta') {
+                text += event.content;
+            } else if (event.type === 'progress') {
+                onProgress(event);
+            } else if (event.error) {
+                // Rejected requests answer with a JSON error instead of a stream
+                text += `An error occurred: ${event.error}`;
+            }
+        }
+        return text;
+    };
+}
+
+// Function to show the latest progress event of a stream below its message
+function showStreamProgress(messageDiv, event) {
+    let progressDiv = messageDiv.parentElement.querySelector('.stream-progress');
+    if (!progressDiv) {
+        progressDiv = document.createElement('div');
+        progressDiv.className = 'stream-progress';
+        messageDiv.insertAdjacentElement('afterend', progressDiv);
+    }
+    progressDiv.innerHTML = '<i class="fa fa-spinner fa-spin"></i> ' + escapeHtml(event.message);
+}
+
+// Function to remove the progress line once text arrives or the stream ends
+function clearStreamProgress(messageDiv) {
+    messageDiv?.parentElement?.querySelector('.stream-progress')?.remove();
+}
+
 function formatUserMessage(input) {
     // Escape HTML special characters
     const escapedInput = input
@@ -1171,6 +1213,53 @@ function cleanMessageForAPI(message) {
     return cleanMessage;
 }
 
+// Get the scope the server indexes fetched sources under, private chats keep none
+function getRetrievalScope() {
+    return isPrivateChat ? null : currentConversationId;
+}
+
+// Forget the server's copy of the current conversation, so the next request resends its history
+function forgetServerConversation() {
+    delete serverConversations[currentConversationId];
+}
+
+// Post a chat request, sending only the new message when the server already holds the conversation's history
+// knownMessages is the history the server will hold afterwards, without the assistant message being generated
+async function postConversationRequest(url, requestBody, apiConversationHistory, knownMessages, signal) {
+    const conversationId = isPrivateChat ? null : currentConversationId;
+    const post = body => fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(body),
+        signal: signal
+    });
+    if (!conversationId) {
+        return post({ ...requestBody, conversation: apiConversationHistory });
+    }
+
+    let response = null;
+    const stored = serverConversations[conversationId];
+    const known = stored && apiConversationHistory.length === stored.length &&
+        JSON.stringify(apiConversationHistory.slice(0, stored.known.length)) === JSON.stringify(stored.known);
+    if (known) {
+        response = await post({ ...requestBody, conversationId: conversationId, version: stored.version });
+    }
+    // The first request, a changed history or a version conflict sends the full history once to resync
+    if (!response || response.status === 409) {
+        response = await post({ ...requestBody, conversationId: conversationId, conversation: apiConversationHistory });
+    }
+
+    const version = response.headers.get('X-Conversation-Version');
+    if (version !== null) {
+        serverConversations[conversationId] = { version: Number(version), known: knownMessages, length: knownMessages.length + 1 };
+    } else {
+        delete serverConversations[conversationId];
+    }
+    return response;
+}
+
 // Update the sendMessage function to use cleanMessageForAPI
 async function sendMessage(event) {
     event.preventDefault();
@@ -1316,9 +1405,10 @@ async function sendMessage(event) {
             systemContent: SYSTEM_CONTENT,
             parameters: MODEL_PARAMETERS,
             isNewChat: isNewChat,
-            conversation: apiConversationHistory,
             isDeepQueryMode: isDeepQueryMode,
-            startTag: START_TAG
+            startTag: START_TAG,
+            retrievalScope: getRetrievalScope(),
+            streamFormat: 'ndjson'
         };
 
         pendingUserMessage = {
@@ -1326,17 +1416,11 @@ async function sendMessage(event) {
             content: messageForAPI
         };
         
-        const response = await fetch('/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(requestBody),
-            signal: currentController.signal
-        });
+        const response = await postConversationRequest('/chat', requestBody, apiConversationHistory,
+            [...apiConversationHistory, pendingUserMessage], currentController.signal);
 
         const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        const parseStreamEvents = createStreamEventParser(event => showStreamProgress(assistantMessage, event));
         let fullResponse = '';
 
         // Create React root for assistant message
@@ -1350,6 +1434,7 @@ async function sendMessage(event) {
                 if (done) {
                     currentController = null;
                     toggleSubmitButtonIcon(false);
+                    clearStreamProgress(assistantMessage);
                     hasScrolledForThinkBlock = false;
                     
                     // Only stop timer if it hasn't been stopped by end tag detection
@@ -1437,7 +1522,9 @@ async function sendMessage(event) {
                     break;
                 }
 
-                const chunk = decoder.decode(value);
+                const chunk = parseStreamEvents(value);
+                if (!chunk) continue;
+                clearStreamProgress(assistantMessage);
                 fullResponse += chunk;
                 
                 // Check if this chunk contains the end tag
@@ -1468,6 +1555,9 @@ async function sendMessage(event) {
 
             } catch (error) {
                 if (error.name === 'AbortError') {
+                    clearStreamProgress(assistantMessage);
+                    // The server may have kept more of the response than arrived here
+                    forgetServerConversation();
                     // Only stop timer if it hasn't been stopped by end tag detection
                     if (streamStartTime) {
                         const duration = stopStreamTimer();
@@ -1944,6 +2034,11 @@ async function deleteConversation(conversationId) {
         
         // Delete from memory
         delete conversations[conversationId];
+        delete serverConversations[conversationId];
+
+        // Drop the sources the server indexed for this conversation
+        fetch(`/conversations/${conversationId}`, { method: 'DELETE' })
+            .catch(error => console.error('Error deleting server-side conversation:', error));
         
         const remainingConversationIds = Object.keys(conversations)
             .sort((a, b) => Number(b) - Number(a));
@@ -2285,6 +2380,8 @@ async function handleMessageEdit(messageDiv, content, role) {
         const newContent = textarea.value;
         
         if (messageIndex !== -1) {
+            // The server's copy does not have the edit
+            forgetServerConversation();
             if (role === 'assistant') {
                 conversationHistory[messageIndex] = {
                     ...originalMessage,
@@ -2427,22 +2524,17 @@ async function sendEditedMessage(newContent, apiConversationHistory) {
             model: selectedModel,
             systemContent: SYSTEM_CONTENT,
             parameters: MODEL_PARAMETERS,
-            conversation: apiConversationHistory,
             isDeepQueryMode: isDeepQueryMode,
-            startTag: START_TAG
+            startTag: START_TAG,
+            retrievalScope: getRetrievalScope(),
+            streamFormat: 'ndjson'
         };
 
-        const response = await fetch('/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(requestBody),
-            signal: currentController.signal
-        });
+        const response = await postConversationRequest('/chat', requestBody, apiConversationHistory,
+            [...apiConversationHistory, { role: "user", content: newContent }], currentController.signal);
 
         const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        const parseStreamEvents = createStreamEventParser(event => showStreamProgress(assistantMessage, event));
 
         // Create a new assistant message container
         assistantMessageContainer = document.createElement('div');
@@ -2474,6 +2566,7 @@ async function sendEditedMessage(newContent, apiConversationHistory) {
             if (done) {
                 currentController = null;
                 toggleSubmitButtonIcon(false);
+                clearStreamProgress(assistantMessage);
                 hasScrolledForThinkBlock = false;
 
                 // Only stop timer if it hasn't been stopped by end tag detection
@@ -2558,7 +2651,9 @@ async function sendEditedMessage(newContent, apiConversationHistory) {
                 break;
             }
 
-            const chunk = decoder.decode(value);
+            const chunk = parseStreamEvents(value);
+            if (!chunk) continue;
+            clearStreamProgress(assistantMessage);
             continuedResponse += chunk;
 
             // Check if this chunk contains the end tag
@@ -2592,6 +2687,9 @@ async function sendEditedMessage(newContent, apiConversationHistory) {
         }
     } catch (error) {
         if (error.name === 'AbortError') {
+            clearStreamProgress(assistantMessage);
+            // The server may have kept more of the response than arrived here
+            forgetServerConversation();
             console.log('Stream aborted by user');
             toggleSubmitButtonIcon(false);
             currentController = null;
@@ -2697,22 +2795,16 @@ async function handleContinueGeneration(messageDiv, previousResponse) {
             currentConversationId && 
             (!conversations[currentConversationId].title || conversationHistory.length <= 2);
         
-        const response = await fetch('/continue_generation', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                conversation: apiConversationHistory,
-                model: selectedModel,
-                systemContent: SYSTEM_CONTENT,
-                parameters: MODEL_PARAMETERS
-            }),
-            signal: currentController.signal
-        });
+        // The continued text is added to the last message, so the server's history keeps the messages before it
+        const response = await postConversationRequest('/continue_generation', {
+            model: selectedModel,
+            systemContent: SYSTEM_CONTENT,
+            parameters: MODEL_PARAMETERS,
+            streamFormat: 'ndjson'
+        }, apiConversationHistory, apiConversationHistory.slice(0, -1), currentController.signal);
 
         const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        const parseStreamEvents = createStreamEventParser(event => showStreamProgress(messageDiv, event));
         let continuedResponse = previousResponse;
 
         // Create or get React root for the message
@@ -2726,6 +2818,7 @@ async function handleContinueGeneration(messageDiv, previousResponse) {
                 if (done) {
                     currentController = null;
                     toggleSubmitButtonIcon(false);
+                    clearStreamProgress(messageDiv);
                     
                     // Only stop timer if it hasn't been stopped by end tag detection
                     if (streamStartTime) {
@@ -2816,7 +2909,9 @@ async function handleContinueGeneration(messageDiv, previousResponse) {
                     break;
                 }
 
-                const chunk = decoder.decode(value);
+                const chunk = parseStreamEvents(value);
+                if (!chunk) continue;
+                clearStreamProgress(messageDiv);
                 continuedResponse += chunk;
                 
                 // Check if this chunk contains the end tag
@@ -2846,6 +2941,9 @@ async function handleContinueGeneration(messageDiv, previousResponse) {
 
             } catch (error) {
                 if (error.name === 'AbortError') {
+                    clearStreamProgress(messageDiv);
+                    // The server may have kept more of the response than arrived here
+                    forgetServerConversation();
                     console.log('Stream aborted by user');
                     toggleSubmitButtonIcon(false);
                     
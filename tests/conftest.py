@@ -0,0 +1,28 @@
+"""Shared fixtures: the app imported once, with every upstream pointed at the benchmark stubs."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from run_benchmarks import load_app
+from stubs import StubServer
+
+
+@pytest.fixture(scope='session')
+def stub():
+    server = StubServer(tokens=16, token_delay=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def app(stub, tmp_path_factory):
+    cwd = os.getcwd()
+    module = load_app(stub, str(tmp_path_factory.mktemp('app')), pdf_pages=4)
+    yield module
+    if module.aiohttp_session is not None:
+        module.run_async(module.aiohttp_session.close())
+    os.chdir(cwd)
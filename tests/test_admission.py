@@ -0,0 +1,37 @@
+import pytest
+
+
+# Function to get the client address the app sees for a request
+def client_address(app, headers, remote_addr='10.0.0.1'):
+    with app.app.test_request_context(headers=headers, environ_base={'REMOTE_ADDR': remote_addr}):
+        return app.get_client_address()
+
+
+def test_uses_the_peer_address_by_default(app):
+    assert client_address(app, {'X-Forwarded-For': '203.0.113.9', 'X-Real-IP': '203.0.113.9'}) == '10.0.0.1'
+
+
+@pytest.mark.parametrize('proxies, expected', [(1, '198.51.100.2'), (2, '203.0.113.9'), (3, '10.0.0.1')])
+def test_trusts_as_many_forwarded_entries_as_there_are_proxies(app, monkeypatch, proxies, expected):
+    monkeypatch.setattr(app, 'TRUSTED_PROXY_COUNT', proxies)
+    assert client_address(app, {'X-Forwarded-For': '203.0.113.9, 198.51.100.2'}) == expected
+
+
+def test_uses_the_configured_client_header(app, monkeypatch):
+    monkeypatch.setattr(app, 'CLIENT_ADDRESS_HEADER', 'X-Real-IP')
+    assert client_address(app, {'X-Real-IP': '203.0.113.9'}) == '203.0.113.9'
+    assert client_address(app, {}) == '10.0.0.1'
+
+
+def test_limits_clients_behind_a_proxy_separately(app, monkeypatch):
+    monkeypatch.setattr(app, 'TRUSTED_PROXY_COUNT', 1)
+    tickets = []
+    try:
+        with app.app.test_request_context(headers={'X-Forwarded-For': '203.0.113.9'}):
+            for _ in range(app.retrieval_gate.client_limit):
+                tickets.append(app.admit_request(app.retrieval_gate))
+        with app.app.test_request_context(headers={'X-Forwarded-For': '198.51.100.2'}):
+            tickets.append(app.admit_request(app.retrieval_gate))
+    finally:
+        for ticket in tickets:
+            ticket.release()
@@ -0,0 +1,40 @@
+import pytest
+
+
+# Function to make an ASGI receive callable that sends the body in chunks
+def chunked_receive(chunks):
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1} for index, chunk in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0)
+    return receive
+
+
+def test_large_bodies_are_spooled_to_disk(app, monkeypatch):
+    monkeypatch.setattr(app, 'ASGI_BODY_SPOOL_BYTES', 1024)
+    body = app.run_async(app.receive_request_body({'headers': []}, chunked_receive([b'x' * 1000, b'y' * 1000])))
+    with body:
+        assert body._rolled
+        assert body.read() == b'x' * 1000 + b'y' * 1000
+
+
+def test_bodies_over_the_limit_are_refused_as_they_arrive(app, monkeypatch):
+    monkeypatch.setattr(app, 'ASGI_MAX_BODY_BYTES', 1500)
+    received = []
+    receive = chunked_receive([b'x' * 1000, b'y' * 1000, b'z' * 1000])
+
+    async def counting_receive():
+        received.append(await receive())
+        return received[-1]
+    with pytest.raises(OverflowError):
+        app.run_async(app.receive_request_body({'headers': []}, counting_receive))
+    assert len(received) == 2
+
+
+def test_declared_length_over_the_limit_is_refused_before_reading(app, monkeypatch):
+    monkeypatch.setattr(app, 'ASGI_MAX_BODY_BYTES', 1500)
+
+    async def receive():
+        raise AssertionError("the body should not be read")
+    with pytest.raises(OverflowError):
+        app.run_async(app.receive_request_body({'headers': [(b'content-length', b'2000')]}, receive))
@@ -0,0 +1,51 @@
+import asyncio
+import uuid
+
+import pytest
+
+
+@pytest.mark.parametrize('payload', [
+    None,
+    {'queries': 'python'},
+    {'queries': []},
+    {'queries': ['python'], 'results': 'many'},
+    {'queries': ['python'], 'results': None},
+    {'queries': ['python'], 'results': 0},
+    {'queries': ['python'], 'results': 11},
+    {'queries': [f'query {index}' for index in range(11)]},
+])
+def test_batch_search_rejects_bad_input(app, payload):
+    response = app.app.test_client().post('/batch-search', json=payload)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_host_schedule_drops_hosts_whose_slot_has_passed(app, monkeypatch):
+    monkeypatch.setattr(app, 'HOST_SCHEDULE_MAX_ENTRIES', 4)
+    monkeypatch.setattr(app, 'HOST_MIN_INTERVAL', 0)
+    app.host_next_request.clear()
+
+    async def visit(count):
+        for index in range(count):
+            async with app.search_slot(f"http://host-{index}.test/"):
+                pass
+
+    app.run_async(visit(50))
+    assert len(app.host_next_request) <= 4
+
+
+def test_search_concurrency_bounds_page_body_downloads(app, stub, monkeypatch):
+    monkeypatch.setattr(app, 'SEARCH_CONCURRENCY', 2)
+    monkeypatch.setattr(app, 'search_semaphore', None)
+    monkeypatch.setattr(app, 'HOST_MIN_INTERVAL', 0)
+    stub.peak_open_bodies = 0
+    urls = [f"{stub.base_url}/trickle/{uuid.uuid4().hex}" for _ in range(6)]
+
+    async def fetch_all():
+        session = await app.get_aiohttp_session()
+        return await asyncio.gather(*(app.fetch_and_format_text(session, url, index) for index, url in enumerate(urls, 1)))
+
+    texts = app.run_async(fetch_all())
+    assert all(url in text for url, text in zip(urls, texts))
+    # Headers arrive at once, so only a slot held through the body read keeps this at the limit
+    assert stub.peak_open_bodies == 2
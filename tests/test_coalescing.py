@@ -0,0 +1,63 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+# Function to run fn(i) in `count` threads released at the same moment
+def run_at_once(fn, count):
+    barrier = threading.Barrier(count)
+
+    def call(i):
+        barrier.wait()
+        return fn(i)
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(call, range(count)))
+
+
+@pytest.fixture
+def slow_url(stub):
+    name = uuid.uuid4().hex
+    return f"{stub.base_url}/slow/{name}", f"slow:{name}"
+
+
+def test_parallel_webpage_commands_download_once(app, stub, slow_url):
+    url, hits_key = slow_url
+    texts = run_at_once(lambda _: app.handle_webpage_command(url), 16)
+    assert stub.hits[hits_key] == 1
+    assert len(set(texts)) == 1 and texts[0]
+
+
+def test_search_page_fetches_download_once(app, stub, slow_url):
+    url, hits_key = slow_url
+
+    async def fetch(index):
+        session = await app.get_aiohttp_session()
+        return await app.fetch_and_format_text(session, url, index)
+
+    texts = run_at_once(lambda i: app.run_async(fetch(i)), 16)
+    assert stub.hits[hits_key] == 1
+    assert all(url in text for text in texts)
+
+
+def test_search_and_webpage_command_share_a_download(app, stub, slow_url):
+    url, hits_key = slow_url
+
+    async def fetch():
+        session = await app.get_aiohttp_session()
+        return await app.fetch_and_format_text(session, url, 1)
+
+    def call(i):
+        return app.run_async(fetch()) if i % 2 else app.handle_webpage_command(url)
+
+    run_at_once(call, 8)
+    assert stub.hits[hits_key] == 1
+
+
+def test_fetch_after_the_leader_finished_uses_the_cache(app, stub, slow_url):
+    url, hits_key = slow_url
+    app.handle_webpage_command(url)
+    app.handle_webpage_command(url)
+    assert stub.hits[hits_key] == 1
@@ -0,0 +1,59 @@
+import httpx
+import pytest
+
+
+@pytest.mark.parametrize('message, expected, link', [
+    ("see https://www.google.com/url?q=https://arxiv.org/abs/2401.12345", 'arxiv', "https://arxiv.org/abs/2401.12345"),
+    ("https://t.co/x?u=youtube.com/watch?v=dQw4w9WgXcQ", 'youtube', "youtube.com/watch?v=dQw4w9WgXcQ"),
+    ("https://example.com/page then https://youtu.be/dQw4w9WgXcQ", 'youtube', "https://youtu.be/dQw4w9WgXcQ"),
+    ("https://arxiv.org/pdf/2401.12345v2", 'arxiv', "https://arxiv.org/pdf/2401.12345v2"),
+    ("read https://example.com/paper.pdf", 'pdf', "https://example.com/paper.pdf"),
+    ("summarize https://example.com/blog/post", 'webpage', "https://example.com/blog/post"),
+])
+def test_highest_priority_link_wins_even_inside_another_link(app, message, expected, link):
+    route, match = app.command_router.classify(message)
+    assert route.name == expected
+    assert match.group(0).startswith(link)
+
+
+def test_message_without_links_is_a_search(app):
+    assert app.command_router.classify("best practices for connection pooling") == (None, None)
+
+
+# Function to build a streamed response around a body, with or without its length
+def streamed_response(body, with_length=True):
+    headers = {'Content-Length': str(len(body))} if with_length else {}
+    return httpx.Response(200, headers=headers, stream=httpx.ByteStream(body))
+
+
+def test_read_limited_refuses_bodies_over_the_limit(app):
+    assert app.read_limited(streamed_response(b'x' * 100), 100) == b'x' * 100
+    with pytest.raises(Exception, match="larger than"):
+        app.read_limited(streamed_response(b'x' * 101), 100)
+    with pytest.raises(Exception, match="larger than"):
+        app.read_limited(streamed_response(b'x' * 101, with_length=False), 100)
+
+
+
+
+@pytest.mark.parametrize('order, before, expected', [
+    ('abc', 'c', 'bac'),
+    ('bca', 'b', 'abc'),
+    ('abc', None, 'bca'),
+])
+def test_registering_a_route_again_moves_it_before_the_given_route(app, order, before, expected):
+    router = app.CommandRouter()
+    for name in order:
+        router.register(app.CommandRoute(name, None, None, None, None, None, None))
+    router.register(app.CommandRoute('a', None, None, None, None, None, None), before)
+    assert ''.join(route.name for route in router.routes) == expected
+
+
+@pytest.mark.parametrize('message, expected', [
+    ("https://www.google.com/url?q=https://arxiv.org/abs/2401.12345 what is new", "what is new"),
+    ("what is new in https://arxiv.org/abs/2401.12345?", "what is new in"),
+    ("summarize https://example.com/blog/post please", "summarize please"),
+])
+def test_the_whole_link_is_removed_from_the_question(app, message, expected):
+    _, match = app.command_router.classify(message)
+    assert app.remove_matched_token(message, match) == expected
@@ -0,0 +1,21 @@
+import uuid
+
+
+def test_client_sends_only_new_messages_once_the_server_holds_the_history(app):
+    client = app.app.test_client()
+    conversation_id = uuid.uuid4().hex
+    history = [{'role': 'user', 'content': "hello"}, {'role': 'assistant', 'content': "hi"}]
+
+    first = client.post('/chat', json={'message': "first", 'model': 'bench-model', 'conversationId': conversation_id, 'conversation': history})
+    first.get_data()
+    version = int(first.headers['X-Conversation-Version'])
+
+    second = client.post('/chat', json={'message': "second", 'model': 'bench-model', 'conversationId': conversation_id, 'version': version})
+    second.get_data()
+    assert second.headers['X-Conversation-Version'] == str(version + 1)
+    stored_version, stored = app.get_conversation_store().get(conversation_id)
+    assert stored_version == version + 1
+    assert [message['content'] for message in stored if message['role'] == 'user'] == ["hello", "first", "second"]
+
+    stale = client.post('/chat', json={'message': "third", 'model': 'bench-model', 'conversationId': conversation_id, 'version': version})
+    assert stale.status_code == 409 and stale.get_json()['version'] == version + 1
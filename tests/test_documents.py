@@ -0,0 +1,39 @@
+import io
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_identical_concurrent_uploads_store_one_document(app, monkeypatch):
+    parse_document = app.parse_document
+
+    # Parsing is slowed down so the uploads overlap
+    def slow_parse_document(path, kind):
+        time.sleep(0.2)
+        return parse_document(path, kind)
+
+    monkeypatch.setattr(app, 'parse_document', slow_parse_document)
+    content = f"Notes {uuid.uuid4().hex}\n".encode() * 50
+    barrier = threading.Barrier(8)
+
+    def upload(_):
+        barrier.wait()
+        return app.ingest_document(io.BytesIO(content), 'notes.txt', 'text')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(upload, range(8)))
+    assert [is_new for _, is_new in results].count(True) == 1
+    assert len({document['documentId'] for document, _ in results}) == 1
+
+    document, is_new = app.ingest_document(io.BytesIO(content), 'notes.txt', 'text')
+    assert not is_new
+
+
+def test_duplicate_upload_answers_200(app):
+    client = app.app.test_client()
+    content = f"Report {uuid.uuid4().hex}".encode()
+    first = client.post('/documents?filename=report.txt', data=content, content_type='text/plain')
+    second = client.post('/documents?filename=report.txt', data=content, content_type='text/plain')
+    assert (first.status_code, first.get_json()['duplicate']) == (201, False)
+    assert (second.status_code, second.get_json()['duplicate']) == (200, True)
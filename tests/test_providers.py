@@ -0,0 +1,127 @@
+import socket
+import time
+
+import httpx
+import pytest
+
+
+# Function to get a local address nothing listens on, for connection errors
+def unused_base_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}/v1"
+
+
+@pytest.fixture
+def use_providers(app, monkeypatch):
+    def use(*providers):
+        configs = [dict({'name': f"provider-{index + 1}", 'api_key': 'test'}, **provider) for index, provider in enumerate(providers)]
+        pool = app.ProviderPool(configs)
+        monkeypatch.setattr(app, 'provider_pool', pool)
+        return pool
+    return use
+
+
+# Function to stream a completion to the end, returns its text
+def complete(app, model='bench-model'):
+    async def collect():
+        return ''.join([delta async for delta in app.stream_completion(model, [{'role': 'user', 'content': 'hello'}], {})])
+    return app.run_async(collect())
+
+
+@pytest.mark.parametrize('code', [429, 503])
+def test_fails_over_on_rate_limits_and_server_errors(app, stub, use_providers, code):
+    pool = use_providers({'base_url': f"{stub.base_url}/status/{code}/v1"}, {'base_url': f"{stub.base_url}/v1"})
+    status_hits, chat_hits = stub.hits[f"status:{code}"], stub.hits['chat']
+    assert complete(app)
+    assert stub.hits[f"status:{code}"] == status_hits + 1
+    assert stub.hits['chat'] == chat_hits + 1
+    failed, served = pool.providers
+    assert failed.failures == 1 and not failed.is_healthy(time.monotonic())
+    assert served.failures == 0
+
+
+def test_fails_over_on_connection_errors(app, stub, use_providers):
+    pool = use_providers({'base_url': unused_base_url()}, {'base_url': f"{stub.base_url}/v1"})
+    assert complete(app)
+    assert pool.providers[0].failures == 1
+
+
+def test_does_not_fail_over_once_text_was_sent(app, stub, use_providers):
+    use_providers({'base_url': f"{stub.base_url}/truncated/v1"}, {'base_url': f"{stub.base_url}/v1"})
+    chat_hits, truncated_hits = stub.hits['chat'], stub.hits['truncated']
+    # A dropped connection fails over before the first token, but here two tokens were already sent
+    with pytest.raises(httpx.RemoteProtocolError):
+        complete(app)
+    assert stub.hits['truncated'] == truncated_hits + 1
+    assert stub.hits['chat'] == chat_hits
+
+
+def test_failed_provider_is_tried_last_until_its_cooldown_ends(app, stub, use_providers, monkeypatch):
+    pool = use_providers({'base_url': f"{stub.base_url}/status/503/v1"}, {'base_url': f"{stub.base_url}/v1"})
+    failing, healthy = pool.providers
+    assert pool.candidates('bench-model') == [failing, healthy]
+
+    complete(app)
+    assert pool.candidates('bench-model') == [healthy, failing]
+    status_hits = stub.hits['status:503']
+    complete(app)
+    assert stub.hits['status:503'] == status_hits  # skipped while cooling down
+
+    # Each failure in a row doubles the cooldown
+    first_cooldown = failing.unavailable_until - time.monotonic()
+    pool.record_failure(failing, Exception("down again"))
+    assert failing.unavailable_until - time.monotonic() > first_cooldown * 1.5
+
+    now = time.monotonic()
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now + app.PROVIDER_COOLDOWN_MAX + 1)
+    assert pool.candidates('bench-model') == [failing, healthy]
+
+
+def test_models_mapping_routes_to_the_providers_serving_the_model(app, use_providers):
+    pool = use_providers(
+        {'base_url': 'http://small.test/v1', 'models': ['small-model']},
+        {'base_url': 'http://large.test/v1', 'models': ['large-model']},
+    )
+    small, large = pool.providers
+    assert pool.candidates('small-model') == [small]
+    assert pool.candidates('large-model') == [large]
+    # A model no provider lists can go to any of them
+    assert set(pool.candidates('other-model')) == {small, large}
+
+
+def test_replaced_providers_close_their_clients(app, stub):
+    configs = [{'name': 'default', 'api_key': 'one', 'base_url': f"{stub.base_url}/v1"}]
+    pool = app.ProviderPool(configs)
+    provider = pool.providers[0]
+    http_client = app.run_async(get_http_client(provider))
+
+    kept = app.ProviderPool(configs, previous=pool)
+    assert kept.providers[0] is provider and not http_client.is_closed
+
+    app.ProviderPool([dict(configs[0], api_key='two')], previous=kept)
+    deadline = time.monotonic() + 5
+    while not http_client.is_closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert http_client.is_closed
+
+
+def test_busy_replaced_provider_is_closed_after_its_last_completion(app, stub):
+    configs = [{'name': 'default', 'api_key': 'one', 'base_url': f"{stub.base_url}/v1"}]
+    pool = app.ProviderPool(configs)
+    provider = pool.providers[0]
+    http_client = app.run_async(get_http_client(provider))
+
+    pool.acquire(provider)
+    replacement = app.ProviderPool([dict(configs[0], api_key='two')], previous=pool)
+    assert not http_client.is_closed
+    replacement.release(provider)
+    deadline = time.monotonic() + 5
+    while not http_client.is_closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert http_client.is_closed
+
+
+# Function to create a provider's client on the event loop, returns its httpx client
+async def get_http_client(provider):
+    return provider.client._client
@@ -0,0 +1,43 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def sent_messages(app, monkeypatch):
+    captured = []
+
+    def capture(selected_model, messages, parameters, *args, **kwargs):
+        captured.extend(messages())
+        kwargs['on_close']()
+        return app.jsonify({})
+    monkeypatch.setattr(app, 'stream_chat_response', capture)
+    return captured
+
+
+def test_retrieved_chunks_are_separated_from_the_follow_up(app, sent_messages):
+    scope = uuid.uuid4().hex
+    app.get_retrieval_index().add(scope, 'page:https://example.com/', "Incremental paragraphs extraction keeps memory flat.")
+    app.app.test_client().post('/chat', json={'message': "paragraphs extraction", 'model': 'bench-model', 'retrievalScope': scope})
+    content = sent_messages[-1]['content']
+    assert content.startswith("paragraphs extraction \n\n ")
+    assert "Incremental paragraphs extraction" in content
+
+
+def test_document_text_is_separated_from_the_message(app, sent_messages):
+    client = app.app.test_client()
+    upload = client.post('/documents?filename=notes.txt', data=f"Document body {uuid.uuid4().hex}".encode())
+    client.post('/chat', json={'message': "summarize", 'model': 'bench-model', 'documentIds': [upload.get_json()['documentId']]})
+    assert sent_messages[-1]['content'].startswith("summarize \n\n ")
+
+
+@pytest.mark.parametrize('budget', ["many", 0, -5, [100], {}])
+def test_chat_rejects_a_bad_context_budget(app, budget):
+    response = app.app.test_client().post('/chat', json={'message': "hello", 'model': 'bench-model', 'contextBudget': budget})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_chat_accepts_a_numeric_context_budget(app, sent_messages):
+    app.app.test_client().post('/chat', json={'message': "hello", 'model': 'bench-model', 'contextBudget': "100"})
+    assert sent_messages[-1]['content'] == "hello"
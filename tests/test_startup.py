@@ -0,0 +1,12 @@
+def test_ready_and_metrics_answer_in_a_process_that_skipped_startup(app, monkeypatch):
+    monkeypatch.setattr(app, 'startup_seconds', None)
+    monkeypatch.setattr(app, 'models_preloaded', None)
+    client = app.app.test_client()
+    ready = client.get('/ready')
+    assert ready.status_code == 200 and ready.get_json()['startup_seconds'] is None
+    assert client.get('/metrics').status_code == 200
+
+
+def test_pending_imports_include_requests(app, monkeypatch):
+    monkeypatch.setattr(app.requests, '_module', None)
+    assert 'requests' in app.get_startup_report()['pending_imports']
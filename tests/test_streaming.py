@@ -0,0 +1,20 @@
+import json
+
+
+def test_sse_event_splits_every_line_break(app):
+    frame = app.format_sse_event(3, 'delta', "one\r\ntwo\rthree\nfour")
+    assert frame == "id: 3\ndata: one\ndata: two\ndata: three\ndata: four\n\n"
+
+
+def test_text_stream_is_labelled_plain_text(app):
+    response = app.app.test_client().post('/chat', json={'message': 'hello', 'model': 'bench-model', 'conversation': []})
+    assert response.mimetype == 'text/plain'
+    assert response.get_data(as_text=True)
+
+
+def test_ndjson_stream_carries_typed_events(app):
+    response = app.app.test_client().post('/chat', json={'message': 'hello', 'model': 'bench-model', 'conversation': [], 'streamFormat': 'ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert {event['type'] for event in events} <= {'progress', 'delta'}
+    assert ''.join(event['content'] for event in events if event['type'] == 'delta')
@@ -0,0 +1,26 @@
+import time
+import uuid
+
+import pytest
+import requests
+import youtube_transcript_api._transcripts
+
+
+def test_stalled_transcript_download_times_out(app, stub, monkeypatch):
+    # The stub serves the watch page slower than the request timeout
+    monkeypatch.setattr(youtube_transcript_api._transcripts, 'WATCH_URL', f"{stub.base_url}/slow/{{video_id}}")
+    monkeypatch.setattr(app, 'TRANSCRIPT_REQUEST_TIMEOUT', 0.05)
+    # The benchmark app lists stub transcripts, so the library's fetcher is put back
+    monkeypatch.setattr(app, 'list_video_transcripts', lambda video_id, session: youtube_transcript_api._transcripts.TranscriptListFetcher(session).fetch(video_id))
+    video_id = uuid.uuid4().hex[:11]
+
+    start = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        app.download_transcript(video_id, ('en',))
+    assert time.monotonic() - start < stub.page_delay
+    assert stub.hits[f"slow:{video_id}"] == 1
+
+
+def test_transcript_session_keeps_explicit_timeouts(app, stub):
+    with app.create_transcript_session() as session:
+        assert session.get(f"{stub.base_url}/slow/{uuid.uuid4().hex}", timeout=5).ok